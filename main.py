@@ -1,19 +1,26 @@
+import numpy as np
 import pandas as pd
 from collections import defaultdict
 import os
 
 # Import các module từ cấu trúc dự án
 from utils.excel_exporter import export_solution_to_excel 
-from utils.data_loader import InputData, get_dataframe_from_excel
+from utils.data_loader import InputData, StylePairs, get_dataframe_from_excel
 from utils.file_handler import save_metaheuristic_result
-from metaheuristic.tabu_search import TabuSearchSolver
+from metaheuristic.tabu_search import TabuSearchSolver, print_solution_summary
+from metaheuristic.multistart import solve_multistart
 
 def load_input(excel_path):
     print(f"Loading data from {excel_path}...")
+    # Mở workbook một lần (openpyxl read-only) và dùng lại cho mọi sheet
+    with pd.ExcelFile(excel_path) as workbook:
+        return _build_input_data(workbook)
+
+def _build_input_data(workbook):
     data = InputData()
     
     # 1. STYLES (Danh sách mã hàng & SAM)
-    df_s = get_dataframe_from_excel(excel_path, 'style_input', header=0).dropna(subset=['Style'])
+    df_s = get_dataframe_from_excel(workbook, 'style_input', header=0).dropna(subset=['Style'])
     data.set['setS'] = df_s['Style'].astype(str).unique().tolist()
     
     # Map các tham số Style
@@ -25,22 +32,22 @@ def load_input(excel_path):
     data.param['Plate'] = {s: 50.0 for s in data.set['setS']}
 
     # 2. LINES (Chuyền may & Nhân sự)
-    df_l = get_dataframe_from_excel(excel_path, 'line_input', header=0).dropna(subset=['Line'])
+    df_l = get_dataframe_from_excel(workbook, 'line_input', header=0).dropna(subset=['Line'])
     data.set['setL'] = df_l['Line'].astype(str).unique().tolist()
     data.param['paramN'] = df_l.set_index('Line')['Sewer'].to_dict()
     data.param['paramExp0'] = df_l.set_index('Line')['Experience'].fillna(0).to_dict()
     
     # Thiết lập trạng thái ban đầu (Y0) - Line đang may mã nào
     data.param['paramY0'] = {}
-    for _, row in df_l.iterrows():
-        line_str = str(row['Line'])
-        current_style = row.get('Current Style')
-        if pd.notna(current_style):
-            for s in data.set['setS']:
-                data.param['paramY0'][(line_str, s)] = 1 if s == current_style else 0
+    if 'Current Style' in df_l.columns:
+        for line, current_style in df_l[['Line', 'Current Style']].itertuples(index=False, name=None):
+            if pd.notna(current_style):
+                line_str = str(line)
+                for s in data.set['setS']:
+                    data.param['paramY0'][(line_str, s)] = 1 if s == current_style else 0
 
     # 3. TIME HORIZON (Lịch làm việc)
-    df_t = get_dataframe_from_excel(excel_path, 'line_date_input', header=1)
+    df_t = get_dataframe_from_excel(workbook, 'line_date_input', header=1)
 
     # Kiểm tra cột, nếu không khớp thì thử đọc lại với header=0
     expected_cols = {'Date', 'Line'}
@@ -52,7 +59,7 @@ def load_input(excel_path):
                 df_t.columns = first_row_vals
                 df_t = df_t[1:]
             else:
-                df_t_alt = get_dataframe_from_excel(excel_path, 'line_date_input', header=0)
+                df_t_alt = get_dataframe_from_excel(workbook, 'line_date_input', header=0)
                 if expected_cols.issubset(df_t_alt.columns):
                     df_t = df_t_alt
 
@@ -71,81 +78,86 @@ def load_input(excel_path):
     
     # Giờ làm việc (paramH)
     data.param['paramH'] = defaultdict(float)
-    for _, row in df_t.iterrows():
-        l_str = str(row['Line'])
-        if l_str in data.set['setL'] and row['Date'] in date_map:
-            data.param['paramH'][(l_str, date_map[row['Date']])] = float(row.get('Working Hour', 0))
+    df_h = pd.DataFrame({
+        'Line': df_t['Line'].astype(str),
+        't': df_t['Date'].map(date_map),
+        'Hour': df_t['Working Hour'].astype(float) if 'Working Hour' in df_t.columns else 0.0,
+    })
+    df_h = df_h[df_h['Line'].isin(data.set['setL']) & df_h['t'].notna()]
+    # Dòng sau ghi đè dòng trước nếu trùng (Line, Date)
+    df_h = df_h.drop_duplicates(subset=['Line', 't'], keep='last')
+    data.param['paramH'].update(zip(zip(df_h['Line'], df_h['t'].astype(int)), df_h['Hour']))
 
 # 4. DEMAND & FABRIC (Đơn hàng & Vải)
-    df_d = get_dataframe_from_excel(excel_path, 'order_input', header=0)
+    df_d = get_dataframe_from_excel(workbook, 'order_input', header=0)
     data.param['paramD'] = defaultdict(float)
     data.param['paramF'] = defaultdict(float)
     
-    # Helper để parse ngày an toàn
-    def parse_date(val):
-        dt = pd.to_datetime(val, errors='coerce')
-        if pd.isna(dt): return None
-        return dt.date()
-
     last_t = data.set['setT'][-1] if data.set['setT'] else 1
 
-    for _, row in df_d.iterrows():
-        s = str(row.get('Style2'))
-        qty = row.get('Sum')
-        
-        if s in data.set['setS'] and pd.notna(qty):
-            qty_val = float(qty)
-            
-            # --- 4.1 Xử lý Demand (D) ---
-            d_date = parse_date(row.get('Exf-SX'))
-            t_d = date_map.get(d_date, last_t)
-            data.param['paramD'][(s, t_d)] += qty_val
-            
-            # --- 4.2 Xử lý Fabric (F) theo tỷ lệ 50% ngày 1 và 50% ngày 2 ---
-            f_start_date = parse_date(row.get('Fabric start ETA RG'))
-            t_start = date_map.get(f_start_date)
-            
-            if t_start:
-                # Ngày 1: Nhận 50%
-                data.param['paramF'][(s, t_start)] += qty_val * 0.5
-                
-                # Ngày 2: Nhận 50% còn lại
-                t_next = t_start + 1
-                if t_next <= last_t:
-                    data.param['paramF'][(s, t_next)] += qty_val * 0.5
-                    print(f"-> Style {s}: Vải về 50% tại T{t_start} và 50% tại T{t_next}")
-                else:
-                    # Trường hợp ngày bắt đầu là ngày cuối cùng của lịch, dồn 100% vào t_start
-                    data.param['paramF'][(s, t_start)] += qty_val * 0.5
-                    print(f"-> Style {s}: Do T{t_start} là ngày cuối, dồn 100% vải vào ngày này")
+    if {'Style2', 'Sum'}.issubset(df_d.columns):
+        df_d = df_d.assign(Style2=df_d['Style2'].astype(str))
+        df_d = df_d[df_d['Style2'].isin(data.set['setS']) & df_d['Sum'].notna()]
+        qty = df_d['Sum'].astype(float)
+
+        # Helper: cột ngày -> chỉ số t (NaN nếu không parse được / ngoài lịch)
+        def to_period(col):
+            if col not in df_d.columns:
+                return pd.Series(float('nan'), index=df_d.index)
+            return pd.to_datetime(df_d[col], errors='coerce').dt.date.map(date_map)
+
+        # --- 4.1 Xử lý Demand (D) ---
+        t_d = to_period('Exf-SX').fillna(last_t).astype(int)
+        data.param['paramD'].update(qty.groupby([df_d['Style2'], t_d]).sum().to_dict())
+
+        # --- 4.2 Xử lý Fabric (F) theo tỷ lệ 50% ngày 1 và 50% ngày 2 ---
+        t_start = to_period('Fabric start ETA RG')
+        has_start = t_start.notna()
+        t_first = t_start[has_start].astype(int)
+        # Nếu ngày bắt đầu là ngày cuối cùng của lịch, dồn 100% vải vào ngày này
+        t_second = (t_first + 1).where(t_first + 1 <= last_t, t_first)
+        # Nếu không tìm thấy ngày bắt đầu, mặc định vải có sẵn ở ngày cuối
+        t_missing = pd.Series(last_t, index=t_start.index[~has_start])
+
+        fabric = pd.DataFrame({
+            's': pd.concat([df_d['Style2'][has_start], df_d['Style2'][has_start], df_d['Style2'][~has_start]]),
+            't': pd.concat([t_first, t_second, t_missing]),
+            'qty': pd.concat([qty[has_start] * 0.5, qty[has_start] * 0.5, qty[~has_start]]),
+        })
+        data.param['paramF'].update(fabric.groupby(['s', 't'])['qty'].sum().to_dict())
+
+        for s, t1, t2 in zip(df_d['Style2'][has_start], t_first, t_second):
+            if t1 != t2:
+                print(f"-> Style {s}: Vải về 50% tại T{t1} và 50% tại T{t2}")
             else:
-                # Nếu không tìm thấy ngày bắt đầu, mặc định vải có sẵn ở ngày cuối
-                data.param['paramF'][(s, last_t)] += qty_val
-                
+                print(f"-> Style {s}: Do T{t1} là ngày cuối, dồn 100% vải vào ngày này")
+
     # 5. CAPABILITIES & LEARNING PARAMETERS
-    df_cap = get_dataframe_from_excel(excel_path, 'enable_style_line_input', header=0)
-    df_lexp = get_dataframe_from_excel(excel_path, 'line_style_input', header=1)
-    
-    data.param['paramYenable'] = {}
-    data.param['paramLexp'] = {}
+    df_cap = get_dataframe_from_excel(workbook, 'enable_style_line_input', header=0)
+    df_lexp = get_dataframe_from_excel(workbook, 'line_style_input', header=1)
     
-    for l in data.set['setL']:
-        # Lọc dòng tương ứng với Line
-        row_cap = df_cap[df_cap.iloc[:, 0].astype(str) == l]
-        row_exp = df_lexp[df_lexp.iloc[:, 0].astype(str) == l]
-        
-        for s in data.set['setS']:
-            # Yenable: Line có được phép may Style này không
-            if not row_cap.empty and s in df_cap.columns:
-                data.param['paramYenable'][(l, s)] = int(row_cap.iloc[0][s])
-            else:
-                 data.param['paramYenable'][(l, s)] = 0
-            
-            # Lexp: Kinh nghiệm ban đầu của Line với Style (nếu có)
-            if not row_exp.empty and s in df_lexp.columns:
-                data.param['paramLexp'][(l, s)] = float(row_exp.iloc[0][s])
-            else:
-                data.param['paramLexp'][(l, s)] = 0.0
+    def line_style_matrix(df, dtype):
+        """Ma trận (Line x Style) theo đúng thứ tự setL/setS, ô thiếu = 0."""
+        if df.empty:
+            return np.zeros((len(data.set['setL']), len(data.set['setS'])), dtype=dtype)
+        df = df.set_index(df.columns[0])
+        df.index = df.index.astype(str)
+        df = df[~df.index.duplicated(keep='first')]
+        return df.reindex(index=data.set['setL'], columns=data.set['setS']).fillna(0).to_numpy(dtype=dtype)
+
+    # Yenable: Line có được phép may Style này không
+    cap_mat = line_style_matrix(df_cap, np.int8)
+    # Lexp: Kinh nghiệm ban đầu của Line với Style (nếu có)
+    lexp_mat = line_style_matrix(df_lexp, np.float64)
+
+    data.param['paramYenable'] = {
+        (l, s): int(cap_mat[i, j])
+        for i, l in enumerate(data.set['setL']) for j, s in enumerate(data.set['setS'])
+    }
+    data.param['paramLexp'] = {
+        (l, s): float(lexp_mat[i, j])
+        for i, l in enumerate(data.set['setL']) for j, s in enumerate(data.set['setS'])
+    }
 
     # 6. LEARNING CURVE (tạo bảng và tra bảng -> O(1))
     lc_sheets = ['learning_curve_input', 'Learning Curve', 'LC_Input', 'Sheet1']
@@ -154,7 +166,7 @@ def load_input(excel_path):
     for sheet in lc_sheets:
         # Gọi loader thông minh: Tự tìm dòng chứa cột 'Experience' và 'Efficiency'
         df_lc = get_dataframe_from_excel(
-            excel_path, 
+            workbook, 
             sheet, 
             expected_columns=['Experience', 'Efficiency'], 
             autodetect_header=True
@@ -181,7 +193,7 @@ def load_input(excel_path):
 
     # 7. OTHER DEFAULTS
     data.set['setSsame'] = [] # Cặp style giống nhau (giữ nguyên kinh nghiệm khi chuyển đổi)
-    data.set['setSP'] = [(s1, s2) for s1 in data.set['setS'] for s2 in data.set['setS']]
+    data.set['setSP'] = StylePairs(data.set['setS']) # Lazy, chỉ liệt kê khi model MIP cần
     
     # Tồn kho ban đầu
     data.param['paramI0fabric'] = {s: 0 for s in data.set['setS']} # vải ban đầu
@@ -197,6 +209,9 @@ def load_input(excel_path):
 if __name__ == "__main__":
     EXCEL_FILE = 'Small.xlsx' 
     RESULT_DIR = 'result'
+    # Số solver chạy song song (Multi-Start); 1 = một solver như trước.
+    # Cố định (không theo số core của máy) để kết quả mặc định không phụ thuộc máy chạy.
+    N_STARTS = 4
     
     if os.path.exists(EXCEL_FILE):
         # 1. Load Data
@@ -210,8 +225,12 @@ if __name__ == "__main__":
         print("\n--- BẮT ĐẦU TỐI ƯU HÓA ---")
         # max_iter: Số vòng lặp tối đa
         # max_time: Thời gian chạy tối đa (giây)
-        solver = TabuSearchSolver(input_data, max_iter=5000, tabu_tenure=15, max_time=600)
-        best_solution = solver.solve()
+        if N_STARTS > 1:
+            best_solution = solve_multistart(input_data, n_starts=N_STARTS, max_iter=5000,
+                                             tabu_tenure=15, max_time=600)
+        else:
+            solver = TabuSearchSolver(input_data, max_iter=5000, tabu_tenure=15, max_time=600)
+            best_solution = solver.solve()
         
         # 3. Save & Report
         os.makedirs(RESULT_DIR, exist_ok=True)
@@ -220,7 +239,7 @@ if __name__ == "__main__":
         save_metaheuristic_result(best_solution, filename = "result.pkl", folder=RESULT_DIR)
         
         # In tóm tắt ra màn hình
-        solver.print_solution_summary()
+        print_solution_summary(best_solution)
         
         # Xuất ra Excel báo cáo
         report_path = os.path.join(RESULT_DIR, 'Production_Plan_Report.xlsx')
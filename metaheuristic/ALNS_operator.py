@@ -1,8 +1,11 @@
-import copy
-from collections import defaultdict
+import os
 import random
 import numpy as np
 import math
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from ._fastops import HAS_NUMBA, simulate
 
 class ALNSOperator:
     """
@@ -10,24 +13,63 @@ class ALNSOperator:
     1. Integer ID Mapping: Tối ưu hiệu năng.
     2. Efficiency Lookup Table: Tra bảng thay vì tính toán O(1).
     3. Strict Material Logic: Xử lý triệt để Trailing Zero & Idle Switch.
+    4. Delta Evaluation: Láng giềng chỉ mô phỏng lại từ ngày thay đổi.
     """
 
-    def __init__(self, input_data, cap_map, discount_alpha):
+    # Mảng kết quả + snapshot theo ngày được giữ trong solution['sim_arrays']
+    _STATE_KEYS = ('production', 'experience', 'efficiency', 'changed', 'shipment',
+                   'prod_hist', 'snap_style', 'snap_line', 'snap_style_state', 'snap_cost')
+
+    def __init__(self, input_data, cap_map, discount_alpha, n_workers=None, float_dtype=np.float64,
+                 cache_size=0):
         self.input = input_data
         self.alpha = discount_alpha
+
+        # Kiểu số thực cho mảng số lượng trong mô phỏng (float32 = nửa bộ nhớ,
+        # có sai số làm tròn); chi phí tích lũy luôn tính bằng float64
+        self.float_dtype = np.dtype(float_dtype)
+
+        # Số thread đánh giá láng giềng song song (evaluate_batch)
+        self.n_workers = n_workers if n_workers is not None else (os.cpu_count() or 1)
+        self._executor = None
+
+        # Cache LRU kết quả mô phỏng theo assignment (đã repair), 0 = tắt
+        self.cache_size = cache_size
+        self._eval_cache = OrderedDict()
         
         # --- 1. Map String <-> Integer ID ---
         all_styles = sorted(list(self.input.set['setS']))
         self.style_to_id = {name: i for i, name in enumerate(all_styles)}
         self.id_to_style = {i: name for i, name in enumerate(all_styles)}
+
+        # Line / Time -> chỉ số mảng (dùng cho kernel mô phỏng)
+        self.lines = list(self.input.set['setL'])
+        self.line_to_idx = {l: i for i, l in enumerate(self.lines)}
+        self.times = sorted(self.input.set['setT'])
+        self.time_to_idx = {t: i for i, t in enumerate(self.times)}
         
         # --- 2. Cache Capability ---
         self.line_allowed_sets = {} 
         self.line_allowed_lists = {}
+        # Ma trận cho phép (line index, style ID) để kiểm tra cả mảng phân công một lần
+        self.allowed_mat = np.zeros((len(self.lines), len(self.style_to_id)), dtype=np.bool_)
         for l in self.input.set['setL']:
             ids = [self.style_to_id[s] for s in cap_map[l] if s in self.style_to_id]
             self.line_allowed_sets[l] = set(ids)
             self.line_allowed_lists[l] = ids
+            self.allowed_mat[self.line_to_idx[l], ids] = True
+
+        # Mã đang chạy đầu kỳ của từng line (paramY0 = 1); nếu nhiều mã, lấy ID nhỏ nhất
+        self._initial_style_id = {l: None for l in self.lines}
+        for (l, s_name), val in self.input.param.get('paramY0', {}).items():
+            s_id = self.style_to_id.get(s_name)
+            if val == 1 and s_id is not None and l in self._initial_style_id:
+                current = self._initial_style_id[l]
+                self._initial_style_id[l] = s_id if current is None else min(current, s_id)
+
+        # (line, time) -> chỉ số phẳng trong mảng (L, T)
+        self.cell_index = {(l, t): i * len(self.times) + j
+                           for i, l in enumerate(self.lines) for j, t in enumerate(self.times)}
 
         # --- 3. Efficiency Lookup Table (Tạo bảng tra cứu) ---
         self.max_lookup_day = 2000 # Đủ lớn cho số ngày kinh nghiệm
@@ -44,67 +86,223 @@ class ALNSOperator:
             self.pruning_cutoff = best_cost * 1.2
 
     def _build_efficiency_lookup(self):
-        """Tính trước Efficiency cho mọi mức kinh nghiệm."""
-        table = {}
+        """Tính trước Efficiency cho mọi mức kinh nghiệm (nội suy tuyến tính, kẹp 2 đầu)."""
+        days = np.arange(self.max_lookup_day + 1, dtype=np.float64)
         breakpoints = sorted(self.input.set['setBP'])
-        if not breakpoints: return {i: 1.0 for i in range(self.max_lookup_day + 1)}
-            
-        curve = [(self.input.param['paramXp'][p], self.input.param['paramFp'][p]) for p in breakpoints]
-        
-        def calc_eff(exp_days):
-            if exp_days <= curve[0][0]: return curve[0][1]
-            if exp_days >= curve[-1][0]: return curve[-1][1]
-            for i in range(len(curve) - 1):
-                x1, y1 = curve[i]
-                x2, y2 = curve[i+1]
-                if x1 <= exp_days <= x2:
-                    return y1 + (y2 - y1) * (exp_days - x1) / (x2 - x1)
-            return curve[-1][1]
-
-        for day in range(self.max_lookup_day + 1):
-            table[day] = calc_eff(day)
-        return table
+        if not breakpoints: return np.ones_like(days)
+
+        self._Xp = np.array([self.input.param['paramXp'][p] for p in breakpoints], dtype=np.float64)
+        self._Fp = np.array([self.input.param['paramFp'][p] for p in breakpoints], dtype=np.float64)
+        return np.interp(days, self._Xp, self._Fp)
 
     def get_efficiency(self, exp_days):
         """Tra cứu O(1)"""
-        day_idx = int(exp_days)
-        if day_idx >= self.max_lookup_day: return self.efficiency_table[self.max_lookup_day]
-        if day_idx < 0: return self.efficiency_table[0]
-        return self.efficiency_table[day_idx]
+        day_idx = min(max(int(exp_days), 0), self.max_lookup_day)
+        return float(self.efficiency_table[day_idx])
 
     def _precompute_data(self):
-        precomputed = {'style_sam': {}, 'line_capacity': {}}
-        for s_name, s_id in self.style_to_id.items():
-            precomputed['style_sam'][s_id] = self.input.param['paramSAM'][s_name]
-            
-        for l in self.input.set['setL']:
-            precomputed['line_capacity'][l] = [
-                self.input.param['paramH'].get((l, t), 0) * 60 * self.input.param['paramN'][l]
-                for t in self.input.set['setT']
-            ]
+        precomputed = {'line_capacity': {}}
+        num_styles = len(self.style_to_id)
+
+        def style_vector(param_name, dtype=np.float64, default=0):
+            """Chuyển param {style: value} thành vector đánh chỉ số theo style ID."""
+            vec = np.full(num_styles, default, dtype=dtype)
+            for s_name, val in self.input.param[param_name].items():
+                if s_name in self.style_to_id:
+                    vec[self.style_to_id[s_name]] = val
+            return vec
+
+        precomputed['sam'] = style_vector('paramSAM')
+        precomputed['plate'] = style_vector('Plate')
+        precomputed['tfab'] = style_vector('paramTfabprocess', dtype=np.int64)
+        precomputed['tprod'] = style_vector('paramTprodfinish', dtype=np.int64)
+
+        # Demand / Fabric dạng ma trận dày (style ID x t), cột 0 không dùng
+        max_t = max(self.input.set['setT'], default=0)
+        for key, param_name in [('demand', 'paramD'), ('fabric', 'paramF')]:
+            mat = np.zeros((num_styles, max_t + 1))
+            for (s_name, t), val in self.input.param[param_name].items():
+                if s_name in self.style_to_id and 0 <= t <= max_t:
+                    mat[self.style_to_id[s_name], t] = val
+            precomputed[key] = mat
+
+        # Vải về kho theo ngày, dịch trước theo lead time: fab_arrival[s, t] = fabric[s, t - Tfab[s]]
+        src_t = np.arange(max_t + 1)[None, :] - precomputed['tfab'][:, None]
+        has_src = (src_t >= 0) & (src_t <= max_t)
+        precomputed['fab_arrival'] = np.zeros_like(precomputed['fabric'])
+        precomputed['fab_arrival'][has_src] = precomputed['fabric'][np.nonzero(has_src)[0], src_t[has_src]]
+
+        # Tồn kho / backlog ban đầu theo ID (copy mỗi lần đánh giá)
+        precomputed['inv_fab0'] = style_vector('paramI0fabric')
+        precomputed['inv_prod0'] = style_vector('paramI0product')
+        precomputed['backlog0'] = style_vector('paramB0')
+
+        # Năng lực (phút) và ngày làm việc theo (line, time index)
+        num_lines, num_times = len(self.lines), len(self.times)
+        precomputed['line_capacity'] = np.zeros((num_lines, num_times))
+        precomputed['work'] = np.zeros((num_lines, num_times), dtype=np.bool_)
+        for i, l in enumerate(self.lines):
+            for j, t in enumerate(self.times):
+                hours = self.input.param['paramH'].get((l, t), 0)
+                precomputed['line_capacity'][i, j] = hours * 60 * self.input.param['paramN'][l]
+                precomputed['work'][i, j] = hours > 0
+
+        # Trạng thái ban đầu và kinh nghiệm theo line
+        precomputed['start_style'] = np.full(num_lines, -1, dtype=np.int32)
+        for i, l in enumerate(self.lines):
+            s_id = self._get_initial_style_id(l)
+            if s_id is not None:
+                precomputed['start_style'][i] = s_id
+        precomputed['exp0'] = np.array(
+            [self.input.param['paramExp0'].get(l, 0) for l in self.lines], dtype=np.float64)
+        precomputed['lexp'] = np.zeros((num_lines, num_styles))
+        for (l, s_name), val in self.input.param['paramLexp'].items():
+            if l in self.line_to_idx and s_name in self.style_to_id:
+                precomputed['lexp'][self.line_to_idx[l], self.style_to_id[s_name]] = val
+
+        # Cặp style giống nhau (giữ nguyên kinh nghiệm khi chuyển đổi)
+        precomputed['same_style'] = np.zeros((num_styles, num_styles), dtype=np.bool_)
+        for s1, s2 in self.input.set['setSsame']:
+            if s1 in self.style_to_id and s2 in self.style_to_id:
+                precomputed['same_style'][self.style_to_id[s1], self.style_to_id[s2]] = True
+
+        # Danh sách style cho phép của từng line (đệm -1), giữ thứ tự line_allowed_lists
+        max_opts = max((len(ids) for ids in self.line_allowed_lists.values()), default=0)
+        precomputed['allowed_ids'] = np.full((num_lines, max(max_opts, 1)), -1, dtype=np.int32)
+        precomputed['allowed_count'] = np.zeros(num_lines, dtype=np.int32)
+        for i, l in enumerate(self.lines):
+            ids = self.line_allowed_lists[l]
+            precomputed['allowed_ids'][i, :len(ids)] = ids
+            precomputed['allowed_count'][i] = len(ids)
+
+        precomputed['eff_table'] = self.efficiency_table
+
+        # Hệ số chiết khấu 1/(1+alpha)^t, đánh chỉ số theo giá trị t
+        precomputed['disc'] = 1.0 / (1.0 + self.alpha) ** np.arange(max_t + 1, dtype=np.float64)
+
+        # Cận dưới chi phí trễ còn lại từ mỗi time index (cho Fast Fail)
+        precomputed['late_lb'] = self._build_late_lower_bound(precomputed)
+
+        # Khóa dict kết quả theo thứ tự phẳng (row-major) của các mảng (L, T) / (S, T)
+        precomputed['cell_keys'] = [(l, t) for l in self.lines for t in self.times]
+        precomputed['shipment_keys'] = [(s_id, t) for s_id in range(num_styles) for t in self.times]
+
+        # Tham số tĩnh truyền cho kernel simulate (đúng thứ tự tham số)
+        def fl(arr):
+            return arr.astype(self.float_dtype, copy=False)
+
+        precomputed['sim_args'] = (
+            np.asarray(self.times, dtype=np.int64), precomputed['start_style'], fl(precomputed['exp0']),
+            precomputed['work'], fl(precomputed['line_capacity']), fl(precomputed['sam']),
+            precomputed['tprod'], fl(precomputed['plate']),
+            fl(precomputed['demand']), fl(precomputed['fab_arrival']), fl(precomputed['inv_fab0']),
+            fl(precomputed['inv_prod0']), fl(precomputed['backlog0']), fl(precomputed['lexp']),
+            precomputed['same_style'], precomputed['allowed_ids'], precomputed['allowed_count'],
+            fl(precomputed['eff_table']), fl(precomputed['disc']), precomputed['late_lb'],
+            float(self.input.param['Csetup']), float(self.input.param['Rexp']),
+        )
         return precomputed
 
-    def _discount(self, t: int) -> float:
-        return 1.0 / (1.0 + self.alpha) ** t
+    def _build_late_lower_bound(self, precomputed):
+        """
+        Cận dưới (admissible) của chi phí trễ từ đầu ngày time index ti tới cuối kỳ,
+        đúng với mọi phân công: late_lb[ti] = tổng các ngày τ >= times[ti].
+
+        Backlog của style s ngày τ không thể nhỏ hơn nhu cầu lũy kế trừ phần có thể
+        sản xuất xong trước τ - Tprod[s]. Phần sản xuất được nới lỏng: mọi line
+        chạy hết năng lực với hiệu suất cao nhất mà kinh nghiệm của nó có thể đạt
+        (tăng tối đa 1 ngày/ngày từ max(Exp0, Lexp)) và chia tùy ý giữa các style
+        được phép, chỉ bị giới hạn bởi vải đã về; khi đó backlog nhỏ nhất có được
+        bằng knapsack phân số ưu tiên style có Plate/SAM lớn.
+        """
+        num_times = len(self.times)
+        late_lb = np.zeros(num_times + 1)
+        if num_times == 0:
+            return late_lb
+
+        sam, plate, tprod = precomputed['sam'], precomputed['plate'], precomputed['tprod']
+        max_t = precomputed['demand'].shape[1] - 1
+        times = np.asarray(self.times, dtype=np.int64)
+
+        # Phút x hiệu suất tối đa lũy kế tới hết ngày t: theo line và theo style (qua line được phép)
+        eff_cap = np.maximum.accumulate(precomputed['eff_table'])
+        exp_cap = (np.maximum(precomputed['exp0'], precomputed['lexp'].max(axis=1, initial=0.0))[:, None]
+                   + np.arange(num_times)[None, :])
+        eff_ub = eff_cap[np.clip(exp_cap.astype(np.int64), 0, len(eff_cap) - 1)]
+        line_day = np.zeros((len(self.lines), max_t + 1))
+        line_day[:, times] = precomputed['line_capacity'] * precomputed['work'] * eff_ub
+        cum_line = np.cumsum(line_day, axis=1)
+        cum_total = cum_line.sum(axis=0)
+        cum_style = self.allowed_mat.T.astype(np.float64) @ cum_line
+
+        # Số lượng style s làm xong tối đa tới hết ngày d: vải có trước ngày k cộng năng
+        # lực các ngày k..d, lấy min theo k (running minimum trên cột đã đệm ngày "-1")
+        unit_cap = np.divide(cum_style, sam[:, None], out=np.zeros_like(cum_style),
+                             where=sam[:, None] > 0)
+        unit_cap = np.hstack([np.zeros((len(sam), 1)), unit_cap])
+        cum_fab = np.hstack([precomputed['inv_fab0'][:, None],
+                             precomputed['inv_fab0'][:, None] + np.cumsum(precomputed['fab_arrival'], axis=1)])
+        max_done = unit_cap[:, 1:] + np.minimum.accumulate(cum_fab - unit_cap, axis=1)[:, 1:]
+
+        cum_demand = np.cumsum(precomputed['demand'], axis=1)
+        producible = np.flatnonzero(sam > 0)
+        order = producible[np.argsort(-(plate[producible] / sam[producible]), kind='stable')]
+
+        day_lb = np.zeros(num_times)
+        for ti, t in enumerate(times.tolist()):
+            # Lượng cần đã sản xuất xong (ngày <= t - Tprod) để không bị trễ ngày t
+            need = precomputed['backlog0'] - precomputed['inv_prod0'] + cum_demand[:, t]
+            done_by = t - tprod
+            # Mốc năng lực chung: style có Tprod nhỏ nhất được dùng nhiều ngày nhất
+            last_day = int(done_by.max()) if len(done_by) else -1
+            minutes = cum_total[min(last_day, max_t)] if last_day >= 0 else 0.0
+            short = np.maximum(need, 0.0)
+            for s in order:
+                d = done_by[s]
+                if short[s] <= 0 or d < 0 or minutes <= 0:
+                    continue
+                d = min(d, max_t)
+                qty = min(short[s], max_done[s, d], minutes / sam[s])
+                if qty > 0:
+                    short[s] -= qty
+                    minutes -= qty * sam[s]
+            # Kernel chỉ tính trễ khi backlog > EPS
+            short[short <= 1e-6] = 0.0
+            day_lb[ti] = float(short @ plate) * precomputed['disc'][t]
+
+        late_lb[:num_times] = np.cumsum(day_lb[::-1])[::-1]
+        return late_lb
 
     def _is_allowed(self, line, style_id):
         return style_id in self.line_allowed_sets[line]
 
+    def _is_allowed_id(self, l_idx, s_id):
+        """Như _is_allowed nhưng theo chỉ số line (dùng cho code làm việc trên mảng)."""
+        return bool(self.allowed_mat[l_idx, s_id])
+
     def _random_allowed_style_id(self, line):
         options = self.line_allowed_lists.get(line)
         if not options: return None
         return random.choice(options)
 
     def _get_initial_style_id(self, line):
-        if 'paramY0' in self.input.param:
-            for s_name, s_id in self.style_to_id.items():
-                if self.input.param['paramY0'].get((line, s_name), 0) == 1:
-                    return s_id
-        return None
+        return self._initial_style_id.get(line)
+
+    def assignment_to_array(self, assignment):
+        """
+        Chuyển assignment dạng dict {(line, t): style ID / tên style / None}
+        sang mảng int32 (L, T); ô trống hoặc tên không xác định = -1.
+        """
+        arr = np.full((len(self.lines), len(self.times)), -1, dtype=np.int32)
+        for key, s_id in assignment.items():
+            if isinstance(s_id, str): s_id = self.style_to_id.get(s_id)
+            if s_id is not None:
+                arr.reshape(-1)[self.cell_index[key]] = s_id
+        return arr
 
     def initialize_solution(self):
         # (Giữ nguyên logic khởi tạo như cũ)
-        solution = {'assignment': {}}
+        solution = {'assignment': np.full((len(self.lines), len(self.times)), -1, dtype=np.int32)}
         demand_by_id_time = {}
         for (s_name, t), val in self.input.param['paramD'].items():
             if s_name in self.style_to_id:
@@ -119,230 +317,189 @@ class ALNSOperator:
             if not demands: initial_style_id = self._random_allowed_style_id(l)
             else: initial_style_id = max(demands, key=demands.get)
             
-            for t in self.input.set['setT']:
-                solution['assignment'][(l, t)] = initial_style_id
+            if initial_style_id is not None:
+                solution['assignment'][self.line_to_idx[l], :] = initial_style_id
         
         return self.repair_and_evaluate(solution)
 
-    def repair_and_evaluate(self, solution):
+    def repair_and_evaluate(self, solution, base=None):
         """
         Vòng lặp mô phỏng chính với Logic kiểm tra tồn kho chặt chẽ.
+        Phần mô phỏng chạy trong kernel `simulate` (Numba), ở đây chỉ
+        chuyển đổi assignment <-> mảng ID và dựng lại các dict kết quả.
+
+        Parameters
+        ----------
+        base : dict, optional
+            Lời giải gốc (đã đánh giá) mà `solution` được sinh ra từ đó. Nếu có,
+            chỉ mô phỏng lại từ ngày thay đổi sớm nhất (đánh giá delta).
         """
-        assignment = solution.get('assignment', {})
-        
+        job = self._prepare_simulation(solution, base)
+        result = self._run_simulation(job)
+        return self._finish_simulation(solution, job, result)
+
+    def evaluate_batch(self, solutions, base=None):
+        """
+        Đánh giá nhiều giải pháp độc lập (láng giềng) cùng lúc.
+
+        Phần repair/dựng dict chạy tuần tự (và rút seed ngẫu nhiên theo đúng
+        thứ tự), chỉ các kernel mô phỏng (nogil) được chia đều cho thread pool.
+        Kết quả giống hệt gọi `repair_and_evaluate` lần lượt từng giải pháp
+        (với cùng `base`).
+
+        Returns
+        -------
+        list
+            Danh sách giải pháp đã đánh giá, cùng thứ tự với đầu vào.
+        """
+        jobs = [self._prepare_simulation(sol, base) for sol in solutions]
+
+        executor = self._get_executor()
+        if executor is None or len(jobs) < 2:
+            results = [self._run_simulation(job) for job in jobs]
+        else:
+            # Chia thành n_workers khối ~ ceil(N/n_workers) để giảm overhead submit
+            chunk = math.ceil(len(jobs) / self.n_workers)
+            futures = [executor.submit(self._run_simulation_chunk, jobs[k:k + chunk])
+                       for k in range(0, len(jobs), chunk)]
+            results = [res for fut in futures for res in fut.result()]
+
+        return [self._finish_simulation(sol, job, res)
+                for sol, job, res in zip(solutions, jobs, results)]
+
+    def _get_executor(self):
+        """Thread pool dùng chung (chỉ tạo khi có Numba, vì kernel Python thuần giữ GIL)."""
+        if self.n_workers <= 1 or not HAS_NUMBA:
+            return None
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.n_workers)
+        return self._executor
+
+    def _prepare_simulation(self, solution, base=None):
+        """Repair ID không hợp lệ và chuẩn bị mảng cho kernel."""
+        assignment = solution.get('assignment')
+        num_lines, num_times = len(self.lines), len(self.times)
+        num_styles = len(self.style_to_id)
+
+        # Assignment là mảng int32 (L, T) style ID, -1 = trống; dict cũ vẫn được nhận
+        if assignment is None:
+            assign_arr = np.full((num_lines, num_times), -1, dtype=np.int32)
+        elif isinstance(assignment, dict):
+            assign_arr = self.assignment_to_array(assignment)
+        else:
+            assign_arr = np.ascontiguousarray(assignment, dtype=np.int32)
+
         # --- REPAIR ID ---
-        for (l, t), s_id in list(assignment.items()):
-            if isinstance(s_id, str): s_id = self.style_to_id.get(s_id)
-            if s_id is None or not self._is_allowed(l, s_id):
-                assignment[(l, t)] = self._random_allowed_style_id(l)
-        solution['assignment'] = assignment
+        # Kiểm tra hợp lệ cho cả mảng một lần, rồi bốc ngẫu nhiên mã hợp lệ cho
+        # mọi ô vi phạm cùng lúc
+        out_of_range = (assign_arr < 0) | (assign_arr >= num_styles)
+        line_idx = np.arange(num_lines)[:, None]
+        invalid = out_of_range | ~self.allowed_mat[line_idx, np.where(out_of_range, 0, assign_arr)]
+        if invalid.any():
+            rows, cols = np.nonzero(invalid)
+            counts = self.precomputed['allowed_count'][rows]
+            picks = (np.random.random(len(rows)) * counts).astype(np.int64)
+            # allowed_ids được đệm -1 nên line có counts = 0 tự nhận -1
+            assign_arr[rows, cols] = self.precomputed['allowed_ids'][rows, picks]
+        solution['assignment'] = assign_arr
+
+        job = {
+            'assignment': assign_arr,
+            'cutoff': self.pruning_cutoff,
+            'seed': random.getrandbits(31),
+            'start_ti': 0,
+            'backlog': np.zeros(num_styles, dtype=self.float_dtype),
+        }
+
+        # --- CACHE: assignment này đã được mô phỏng xong -> dùng lại kết quả ---
+        if self.cache_size > 0:
+            job['cache_key'] = assign_arr.tobytes()
+            cached = self._eval_cache.get(job['cache_key'])
+            if cached is not None:
+                self._eval_cache.move_to_end(job['cache_key'])
+                job['cached_result'] = cached[0]
+                job.update(cached[1])
+                return job
+
+        # --- DELTA: tiếp tục từ snapshot của lời giải gốc ---
+        # Assignment gốc đã được repair nên mô phỏng lại phần đầu giống hệt nhau;
+        # lùi thêm 1 ngày vì quyết định ngày t nhìn trước phân công ngày t+1.
+        base_arrays = base.get('sim_arrays') if base is not None else None
+        if base_arrays is not None:
+            diff_cols = np.flatnonzero((assign_arr != base_arrays['assignment']).any(axis=0))
+            first_diff = diff_cols[0] if len(diff_cols) else num_times - 1
+            job['start_ti'] = max(int(first_diff) - 1, 0)
+        if job['start_ti'] > 0:
+            for key in self._STATE_KEYS:
+                job[key] = base_arrays[key].copy()
+            return job
+
+        max_t = self.precomputed['demand'].shape[1] - 1
+        fd = self.float_dtype
+        job.update({
+            'production': np.zeros((num_lines, num_times), dtype=fd),
+            'experience': np.zeros((num_lines, num_times), dtype=fd),
+            'efficiency': np.zeros((num_lines, num_times), dtype=fd),
+            'changed': np.zeros((num_lines, num_times), dtype=np.bool_),
+            'shipment': np.zeros((num_styles, num_times), dtype=fd),
+            'prod_hist': np.zeros((num_styles, max_t + 1), dtype=fd),
+            'snap_style': np.zeros((num_times, num_lines), dtype=np.int32),
+            'snap_line': np.zeros((num_times, 2, num_lines), dtype=fd),
+            'snap_style_state': np.zeros((num_times, 3, num_styles), dtype=fd),
+            # Chi phí tích lũy giữ float64 để tránh sai số cộng dồn
+            'snap_cost': np.zeros((num_times, 3)),
+        })
+        return job
+
+    def _run_simulation(self, job):
+        """Gọi kernel mô phỏng; chỉ đụng tới mảng nên an toàn khi chạy song song."""
+        if 'cached_result' in job:
+            return job['cached_result']
+        return simulate(
+            job['assignment'], job['start_ti'], job['cutoff'], job['seed'],
+            job['production'], job['shipment'], job['changed'],
+            job['experience'], job['efficiency'], job['backlog'],
+            job['prod_hist'], job['snap_style'], job['snap_line'],
+            job['snap_style_state'], job['snap_cost'],
+            *self.precomputed['sim_args'])
+
+    def _run_simulation_chunk(self, jobs):
+        return [self._run_simulation(job) for job in jobs]
+
+    def _finish_simulation(self, solution, job, result):
+        """
+        Ghi kết quả kernel vào solution.
+
+        Kết quả chi tiết (production/experience/...) được giữ nguyên dạng mảng
+        trong solution['sim_arrays']; dict theo key chỉ được dựng khi cần xuất
+        (xem `_build_output_dicts`).
+        """
+        setup_cost, late_cost, exp_reward, pruned = result
 
         # --- INIT SIMULATION VARS ---
         move_type = solution.get("type")
-        solution.update({"production": {}, "shipment": {}, "changes": {}, "experience": {}, "efficiency": {}})
+        for key in ("production", "shipment", "changes", "experience", "efficiency", "sim_arrays"):
+            solution.pop(key, None)
 
-        inv_fab = defaultdict(float)
-        inv_prod = defaultdict(float)
-        backlog = defaultdict(float)
-        
-        # Init inventory from params
-        for s_name, val in self.input.param["paramI0fabric"].items():
-            if s_name in self.style_to_id: inv_fab[self.style_to_id[s_name]] = val
-        for s_name, val in self.input.param["paramI0product"].items():
-            if s_name in self.style_to_id: inv_prod[self.style_to_id[s_name]] = val
-        for s_name, val in self.input.param["paramB0"].items():
-            if s_name in self.style_to_id: backlog[self.style_to_id[s_name]] = val
-
-        setup_cost = late_cost = exp_reward = 0.0
-
-        line_states = {
-            l: dict(current_style=self._get_initial_style_id(l),
-                    exp=self.input.param["paramExp0"].get(l, 0),
-                    up_exp=0)
-            for l in self.input.set["setL"]
-        }
-        daily_prod_history = defaultdict(lambda: defaultdict(float))
-
-        # Cache Lookups
-        get_sam = self.precomputed["style_sam"].get
-        get_line_cap = self.precomputed["line_capacity"]
-        param_h = self.input.param["paramH"]
-        param_csetup = self.input.param["Csetup"]
-        param_rexp = self.input.param["Rexp"]
-        param_lexp = {(l, self.style_to_id[s]): v for (l, s), v in self.input.param["paramLexp"].items() if s in self.style_to_id}
-        param_plate = {self.style_to_id[s]: v for s, v in self.input.param["Plate"].items() if s in self.style_to_id}
-        param_tfab = {self.style_to_id[s]: v for s, v in self.input.param["paramTfabprocess"].items() if s in self.style_to_id}
-        param_tprod = {self.style_to_id[s]: v for s, v in self.input.param["paramTprodfinish"].items() if s in self.style_to_id}
-        
-        # Optimize loops
-        all_style_ids = list(self.style_to_id.values())
-        set_l = self.input.set["setL"]
-        sorted_times = sorted(self.input.set["setT"])
-        t_index_map = {t: i for i, t in enumerate(sorted_times)}
-        set_ssame = set((self.style_to_id[s1], self.style_to_id[s2]) for s1, s2 in self.input.set["setSsame"] if s1 in self.style_to_id and s2 in self.style_to_id)
-        
-        # Precompute Param D & F for speed
-        param_F_local = defaultdict(float)
-        for (s_name, t), val in self.input.param["paramF"].items():
-             if s_name in self.style_to_id: param_F_local[(self.style_to_id[s_name], t)] = val
-        
-        param_D_local = defaultdict(float)
-        for (s_name, t), val in self.input.param["paramD"].items():
-             if s_name in self.style_to_id: param_D_local[(self.style_to_id[s_name], t)] = val
-
-        # --- TIME LOOP ---
-        for t in sorted_times:
-            # Fast fail check
-            if setup_cost + late_cost - exp_reward > self.pruning_cutoff:
-                solution['total_cost'] = float('inf'); return solution
-
-            disc_factor = self._discount(t)
-
-            # 1. Fabric Receipts
-            for s_id in all_style_ids:
-                LT_f = param_tfab.get(s_id, 0)
-                inv_fab[s_id] += param_F_local.get((s_id, t - LT_f), 0)
-
-            # 2. Decide Production
-            pot_prod = {s_id: [] for s_id in all_style_ids}
-
-            for l in set_l:
-                st = line_states[l]
-                st["exp"] += st["up_exp"] # Update Exp
-                
-                proposed_style = assignment.get((l, t))
-                work_day = param_h.get((l, t), 0) > 0
-                
-                if proposed_style is None:
-                    st["up_exp"] = 0
-                    continue
+        # Kernel đã sửa tại chỗ các ô bị đổi mã do thiếu nguyên liệu
+        solution['assignment'] = job['assignment']
 
-                # ==========================================================
-                # [CORE LOGIC] MATERIAL AVAILABILITY CHECK
-                # ==========================================================
-                
-                has_material = inv_fab[proposed_style] > 1e-6
-                
-                # Biến cờ: Có phải là ngồi chờ hợp lệ (Bridging) không?
-                is_valid_bridge = False
-                
-                if not has_material:
-                    # Kiểm tra xem có phải đang chờ nguyên liệu không
-                    # Điều kiện chờ: Style giống hôm qua VÀ Style giống ngày mai
-                    # (Nghĩa là kẹp giữa 2 ngày làm việc cùng 1 mã)
-                    prev_is_same = (st["current_style"] == proposed_style)
-                    
-                    next_is_same = False
-                    current_t_idx = t_index_map[t]
-                    if current_t_idx < len(sorted_times) - 1:
-                        next_t = sorted_times[current_t_idx + 1]
-                        if assignment.get((l, next_t)) == proposed_style:
-                            next_is_same = True
-                    
-                    # Chỉ cho phép Qty=0 nếu là Bridging (Prev=Same & Next=Same)
-                    if prev_is_same and next_is_same:
-                        is_valid_bridge = True
-
-                # XỬ LÝ QUYẾT ĐỊNH
-                final_style = proposed_style
-                
-                if not has_material and not is_valid_bridge:
-                    # VI PHẠM: Hết hàng nhưng không phải Bridging -> PHẢI ĐỔI MÃ
-                    # (Đây là fix cho Trailing Zero và Idle Switch)
-                    
-                    # 1. Ưu tiên: Giữ mã cũ (nếu có hàng) để tránh Setup
-                    if st["current_style"] is not None and inv_fab[st["current_style"]] > 1e-6:
-                         final_style = st["current_style"]
-                    else:
-                        # 2. Tìm bất kỳ mã nào khác có hàng trong danh sách cho phép
-                        candidates = self.line_allowed_lists[l]
-                        # Shuffle để tránh thiên vị
-                        candidates_shuffled = list(candidates)
-                        random.shuffle(candidates_shuffled)
-                        
-                        found_alt = False
-                        for cand_id in candidates_shuffled:
-                            if inv_fab[cand_id] > 1e-6:
-                                final_style = cand_id
-                                found_alt = True
-                                break
-                        
-                        # Nếu cùng đường (không mã nào có hàng), đành chấp nhận Qty=0 trên mã cũ
-                        if not found_alt and st["current_style"] is not None:
-                             final_style = st["current_style"]
-
-                    # Update Assignment để Look-ahead các ngày sau thấy sự thay đổi này
-                    assignment[(l, t)] = final_style
-
-                # ==========================================================
-                # END CORE LOGIC
-                # ==========================================================
-
-                # Calculate Setup Cost
-                if st["current_style"] != final_style:
-                    solution["changes"][(l, st["current_style"], final_style, t)] = 1
-                    setup_cost += (param_csetup * disc_factor)
-                    if (st["current_style"], final_style) not in set_ssame:
-                        st["exp"] = param_lexp.get((l, final_style), 0)
-
-                solution["experience"][(l, t)] = st["exp"]
-                
-                # Lookup Efficiency (Fast)
-                eff = self.get_efficiency(st["exp"])
-                solution["efficiency"][(l, t)] = eff
-                
-                exp_reward += st["exp"] * param_rexp
-
-                if work_day:
-                    sam = get_sam(final_style, 0)
-                    if sam > 0:
-                        cap_min = get_line_cap[l][t - 1]
-                        max_p = (cap_min * eff) / sam
-                        pot_prod[final_style].append({"line": l, "max_p": max_p})
-                        st["up_exp"] = 0 
-                    else:
-                        st["up_exp"] = 0
-                else:
-                    st["up_exp"] = 0
-
-                st["current_style"] = final_style
-
-            # 3. Realise Production
-            for s_id, items in pot_prod.items():
-                if not items: continue
-                total_cap = sum(i["max_p"] for i in items)
-                actual_p = min(total_cap, inv_fab[s_id])
-
-                daily_prod_history[s_id][t] = actual_p
-                inv_fab[s_id] -= actual_p
-
-                if total_cap > 0:
-                    for i in items:
-                        share = actual_p * i["max_p"] / total_cap
-                        solution["production"][(i["line"], s_id, t)] = share
-                        # Exp Gain Rule: Làm > 50% năng lực mới được cộng exp
-                        if share >= 0.5 * i["max_p"]:
-                            line_states[i["line"]]["up_exp"] = 1
-
-            # 4. Shipments
-            for s_id in all_style_ids:
-                LT_p = param_tprod.get(s_id, 0)
-                finished = daily_prod_history[s_id].get(t - LT_p, 0.0)
-                inv_prod[s_id] += finished
-                
-                demand_t = param_D_local.get((s_id, t), 0)
-                to_ship = backlog[s_id] + demand_t
-                ship_qty = min(inv_prod[s_id], to_ship)
-
-                solution["shipment"][(s_id, t)] = ship_qty
-                inv_prod[s_id] -= ship_qty
-                backlog[s_id] = to_ship - ship_qty
-
-                if backlog[s_id] > 1e-6:
-                    late_cost += (backlog[s_id] * param_plate.get(s_id, 0) * disc_factor)
+        # Fast fail
+        if pruned:
+            solution['total_cost'] = float('inf'); return solution
+
+        # backlog (S,) cuối kỳ theo ID, dùng thay final_backlog khi cần mảng
+        solution["sim_arrays"] = {key: job[key] for key in ("assignment", "backlog") + self._STATE_KEYS}
+
+        # Chỉ cache kết quả đầy đủ (kết quả bị cắt tỉa phụ thuộc cutoff lúc đó)
+        if 'cache_key' in job and 'cached_result' not in job:
+            self._eval_cache[job['cache_key']] = (
+                result, {key: job[key] for key in ("assignment", "backlog") + self._STATE_KEYS})
+            if len(self._eval_cache) > self.cache_size:
+                self._eval_cache.popitem(last=False)
 
         # Finalize
-        final_backlog_str = {self.id_to_style[k]: v for k, v in backlog.items() if k is not None}
+        final_backlog_str = {self.id_to_style[s_id]: float(v) for s_id, v in enumerate(job['backlog'])}
         solution.update({
             "final_backlog": final_backlog_str,
             "total_setup": setup_cost,
@@ -353,9 +510,58 @@ class ALNSOperator:
         if move_type: solution["type"] = move_type
         return solution
 
+    def _build_output_dicts(self, solution):
+        """
+        Dựng các dict kết quả (production/shipment/changes/experience/efficiency)
+        theo key ID từ solution['sim_arrays']. Chỉ gọi khi cần xuất báo cáo.
+        """
+        arrays = solution.get("sim_arrays")
+        if arrays is None:
+            return {"production": {}, "shipment": {}, "changes": {}, "experience": {}, "efficiency": {}}
+
+        assign_arr = arrays['assignment']
+        production, experience = arrays['production'], arrays['experience']
+        efficiency, changed = arrays['efficiency'], arrays['changed']
+        shipment = arrays['shipment']
+        outputs = {}
+
+        # Chỉ duyệt các ô cần thiết qua np.nonzero
+        cell_keys = self.precomputed['cell_keys']
+        assigned = np.flatnonzero(assign_arr >= 0).tolist()
+        keys = [cell_keys[k] for k in assigned]
+        outputs["experience"] = dict(zip(keys, experience.ravel()[assigned].tolist()))
+        outputs["efficiency"] = dict(zip(keys, efficiency.ravel()[assigned].tolist()))
+
+        flat_assign = assign_arr.ravel()
+        produced = np.flatnonzero(production > 0).tolist()
+        outputs["production"] = {
+            (cell_keys[k][0], s_id, cell_keys[k][1]): qty
+            for k, s_id, qty in zip(produced, flat_assign[produced].tolist(),
+                                    production.ravel()[produced].tolist())
+        }
+
+        # Mã trước đó của từng ô = mã được phân công gần nhất (bỏ qua ô trống)
+        prev_arr = np.empty_like(assign_arr)
+        current = self.precomputed['start_style'].astype(assign_arr.dtype)
+        for j in range(assign_arr.shape[1]):
+            prev_arr[:, j] = current
+            current = np.where(assign_arr[:, j] >= 0, assign_arr[:, j], current)
+        switched = np.flatnonzero(changed).tolist()
+        outputs["changes"] = {
+            (cell_keys[k][0], prev if prev >= 0 else None, s_id, cell_keys[k][1]): 1
+            for k, prev, s_id in zip(switched, prev_arr.ravel()[switched].tolist(),
+                                     flat_assign[switched].tolist())
+        }
+
+        outputs["shipment"] = dict(zip(self.precomputed['shipment_keys'], shipment.ravel().tolist()))
+        return outputs
+
     def convert_solution_to_string_keys(self, solution):
-        new_sol = copy.deepcopy(solution)
-        new_assign = {(l, t): self.id_to_style.get(s_id) for (l, t), s_id in new_sol['assignment'].items()}
+        # Copy nông: các dict kết quả được dựng mới từ sim_arrays, các field khác dùng chung
+        new_sol = {key: val for key, val in solution.items() if key != 'sim_arrays'}
+        new_sol.update(self._build_output_dicts(solution))
+        new_assign = {key: self.id_to_style.get(s_id) for key, s_id
+                      in zip(self.precomputed['cell_keys'], new_sol['assignment'].ravel().tolist())}
         new_prod = {(l, self.id_to_style.get(s_id), t): v for (l, s_id, t), v in new_sol['production'].items()}
         new_sol['assignment'] = new_assign
         new_sol['production'] = new_prod
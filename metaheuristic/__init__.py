@@ -3,5 +3,6 @@ Metaheuristic package - Tabu Search and other optimization algorithms
 """
 
 from .tabu_search import TabuSearchSolver
+from .multistart import solve_multistart
 
-__all__ = ['TabuSearchSolver']
+__all__ = ['TabuSearchSolver', 'solve_multistart']
@@ -0,0 +1,299 @@
+"""
+Kernel số học cho bộ đánh giá (ALNSOperator).
+
+Các hàm ở đây chỉ làm việc với mảng NumPy và số vô hướng (không dict/string)
+để có thể biên dịch bằng Numba. Nếu không cài Numba, chúng vẫn chạy được
+dưới dạng Python thuần (chậm hơn nhiều).
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        """Thay thế @njit khi không có Numba: trả về nguyên hàm Python."""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+# Ngưỡng coi như còn nguyên liệu / còn backlog
+EPS = 1e-6
+
+
+@njit(cache=True, nogil=True)
+def simulate(assignment, start_ti, pruning_cutoff, seed,
+             production, shipment, changed, experience, efficiency, backlog,
+             prod_hist, snap_style, snap_line, snap_style_state, snap_cost,
+             times, start_style, exp0, work, line_cap, sam, tprod, plate,
+             demand, fab_arrival, inv_fab0, inv_prod0, backlog0, lexp, same_style,
+             allowed_ids, allowed_count, eff_table, disc, late_lb, csetup, rexp):
+    """
+    Mô phỏng sản xuất theo ngày cho một phân công đã chuẩn hóa về ID.
+
+    Parameters
+    ----------
+    assignment : int32 (L, T)
+        Style ID của từng (line, time index), -1 = không phân công. Được sửa
+        tại chỗ khi line buộc phải đổi mã do hết vải, để look-ahead các ngày
+        sau thấy thay đổi này.
+    start_ti : int
+        Time index bắt đầu mô phỏng. Nếu > 0 (đánh giá delta), trạng thái đầu
+        ngày start_ti được nạp từ các mảng snapshot, và các cột < start_ti của
+        mảng kết quả / prod_hist phải đã chứa kết quả của lời giải gốc.
+    production, shipment, changed, experience, efficiency, backlog : ndarray
+        Mảng kết quả, được ghi tại chỗ. production/experience/efficiency/changed
+        có dạng (L, T), shipment (S, T), backlog (S,) là backlog cuối kỳ.
+    prod_hist : float64 (S, max_t + 1)
+        Sản lượng hoàn thành theo (style, giá trị t), chỉ được ghi nối tiếp
+        theo ngày nên bản cuối kỳ cũng là snapshot của mọi ngày trước đó.
+    snap_style, snap_line, snap_style_state, snap_cost : ndarray
+        Trạng thái đầu mỗi ngày, ghi tại chỗ: mã hiện tại của line (T, L),
+        [exp, up_exp] (T, 2, L), [inv_fab, inv_prod, backlog] (T, 3, S),
+        [setup, late, exp_reward] (T, 3).
+    times : int64 (T,)
+        Giá trị t (đã sắp xếp) tương ứng từng time index; demand/fab_arrival/disc
+        được đánh chỉ số theo giá trị t.
+    fab_arrival : (S, max_t + 1)
+        Lượng vải về kho theo ngày, đã dịch sẵn theo lead time Tfab.
+    late_lb : float64 (T + 1,)
+        Cận dưới chi phí trễ từ đầu ngày ti tới cuối kỳ (đúng với mọi phân
+        công), cộng vào chi phí tích lũy khi kiểm tra Fast Fail.
+
+    Kernel được biên dịch với nogil=True nên nhiều thread có thể chạy song
+    song (xem ALNSOperator.evaluate_batch). RNG của Numba là riêng cho từng
+    thread và được seed lại trong mỗi lần gọi nên kết quả vẫn tất định.
+
+    Returns
+    -------
+    tuple
+        (setup_cost, late_cost, exp_reward, pruned). pruned=True nếu chi phí
+        tích lũy vượt pruning_cutoff (Fast Fail) và mô phỏng dừng sớm.
+    """
+    num_lines, num_times = assignment.shape
+    num_styles = sam.shape[0]
+    max_eff_idx = eff_table.shape[0] - 1
+
+    pot_total = np.zeros(num_styles)
+    actual_p = np.zeros(num_styles)
+    item_style = np.full(num_lines, -1, dtype=np.int64)
+    item_max_p = np.zeros(num_lines)
+    seeded = False
+
+    if start_ti == 0:
+        inv_fab = inv_fab0.copy()
+        inv_prod = inv_prod0.copy()
+        backlog[:] = backlog0
+        prod_hist[:] = 0.0
+        cur_style = start_style.astype(np.int64)
+        exp = exp0.copy()
+        up_exp = np.zeros(num_lines, dtype=snap_line.dtype)
+        setup_cost = 0.0
+        late_cost = 0.0
+        exp_reward = 0.0
+    else:
+        # Đánh giá delta: nạp trạng thái đầu ngày start_ti của lời giải gốc
+        inv_fab = snap_style_state[start_ti, 0].copy()
+        inv_prod = snap_style_state[start_ti, 1].copy()
+        backlog[:] = snap_style_state[start_ti, 2]
+        cur_style = snap_style[start_ti].astype(np.int64)
+        exp = snap_line[start_ti, 0].copy()
+        up_exp = snap_line[start_ti, 1].copy()
+        setup_cost = snap_cost[start_ti, 0]
+        late_cost = snap_cost[start_ti, 1]
+        exp_reward = snap_cost[start_ti, 2]
+        production[:, start_ti:] = 0.0
+        changed[:, start_ti:] = False
+        experience[:, start_ti:] = 0.0
+        efficiency[:, start_ti:] = 0.0
+
+    for ti in range(start_ti, num_times):
+        # Snapshot trạng thái đầu ngày (dùng cho đánh giá delta sau này)
+        snap_style[ti] = cur_style
+        snap_line[ti, 0] = exp
+        snap_line[ti, 1] = up_exp
+        snap_style_state[ti, 0] = inv_fab
+        snap_style_state[ti, 1] = inv_prod
+        snap_style_state[ti, 2] = backlog
+        snap_cost[ti, 0] = setup_cost
+        snap_cost[ti, 1] = late_cost
+        snap_cost[ti, 2] = exp_reward
+
+        # Fast fail check: chi phí đã tích lũy + phần trễ chắc chắn phải chịu
+        if setup_cost + late_cost - exp_reward + late_lb[ti] > pruning_cutoff:
+            return setup_cost, late_cost, exp_reward, True
+
+        t = times[ti]
+        disc_factor = disc[t]
+
+        # 1. Fabric Receipts
+        for s in range(num_styles):
+            inv_fab[s] += fab_arrival[s, t]
+
+        # 2. Decide Production
+        pot_total[:] = 0.0
+        exp_day = 0.0
+        for l in range(num_lines):
+            exp[l] += up_exp[l]
+            up_exp[l] = 0.0
+            item_style[l] = -1
+
+            proposed = assignment[l, ti]
+            if proposed < 0:
+                continue
+
+            final = proposed
+            if inv_fab[proposed] <= EPS:
+                # Chỉ cho phép Qty=0 nếu là Bridging (Prev=Same & Next=Same)
+                prev_is_same = cur_style[l] == proposed
+                next_is_same = ti < num_times - 1 and assignment[l, ti + 1] == proposed
+                if not (prev_is_same and next_is_same):
+                    # 1. Ưu tiên giữ mã cũ (nếu có hàng) để tránh Setup
+                    if cur_style[l] >= 0 and inv_fab[cur_style[l]] > EPS:
+                        final = cur_style[l]
+                    else:
+                        # 2. Chọn ngẫu nhiên một mã cho phép còn hàng
+                        n_alt = 0
+                        for k in range(allowed_count[l]):
+                            if inv_fab[allowed_ids[l, k]] > EPS:
+                                n_alt += 1
+                        if n_alt > 0:
+                            if not seeded:
+                                np.random.seed(seed)
+                                seeded = True
+                            pick = np.random.randint(0, n_alt)
+                            for k in range(allowed_count[l]):
+                                cand = allowed_ids[l, k]
+                                if inv_fab[cand] > EPS:
+                                    if pick == 0:
+                                        final = cand
+                                        break
+                                    pick -= 1
+                        elif cur_style[l] >= 0:
+                            # Không mã nào có hàng: chấp nhận Qty=0 trên mã cũ
+                            final = cur_style[l]
+                    assignment[l, ti] = final
+
+            # Calculate Setup Cost
+            if cur_style[l] != final:
+                changed[l, ti] = True
+                setup_cost += csetup * disc_factor
+                # Fast fail ngay khi chi phí setup vừa tăng, không chờ hết ngày
+                if setup_cost + late_cost - exp_reward + late_lb[ti] > pruning_cutoff:
+                    return setup_cost, late_cost, exp_reward, True
+                if cur_style[l] < 0 or not same_style[cur_style[l], final]:
+                    exp[l] = lexp[l, final]
+
+            experience[l, ti] = exp[l]
+            day_idx = int(exp[l])
+            if day_idx > max_eff_idx:
+                day_idx = max_eff_idx
+            elif day_idx < 0:
+                day_idx = 0
+            eff = eff_table[day_idx]
+            efficiency[l, ti] = eff
+            exp_day += exp[l]
+
+            if work[l, ti] and sam[final] > 0:
+                max_p = (line_cap[l, ti] * eff) / sam[final]
+                pot_total[final] += max_p
+                item_style[l] = final
+                item_max_p[l] = max_p
+
+            cur_style[l] = final
+
+        # Thưởng kinh nghiệm: cộng dồn theo ngày, nhân Rexp một lần
+        exp_reward += exp_day * rexp
+
+        # 3. Realise Production
+        for s in range(num_styles):
+            actual_p[s] = min(pot_total[s], inv_fab[s])
+            prod_hist[s, t] = actual_p[s]
+            inv_fab[s] -= actual_p[s]
+
+        for l in range(num_lines):
+            s = item_style[l]
+            if s >= 0 and pot_total[s] > 0:
+                share = actual_p[s] * item_max_p[l] / pot_total[s]
+                production[l, ti] = share
+                # Exp Gain Rule: Làm > 50% năng lực mới được cộng exp
+                if share >= 0.5 * item_max_p[l]:
+                    up_exp[l] = 1.0
+
+        # 4. Shipments
+        late_day = 0.0
+        for s in range(num_styles):
+            t_done = t - tprod[s]
+            if t_done >= 0:
+                inv_prod[s] += prod_hist[s, t_done]
+            to_ship = backlog[s] + demand[s, t]
+            ship_qty = min(inv_prod[s], to_ship)
+            shipment[s, ti] = ship_qty
+            inv_prod[s] -= ship_qty
+            backlog[s] = to_ship - ship_qty
+            if backlog[s] > EPS:
+                late_day += backlog[s] * plate[s]
+        late_cost += late_day * disc_factor
+
+    return setup_cost, late_cost, exp_reward, False
+
+
+@njit(cache=True, nogil=True)
+def move_signature(old_assign, new_assign, zobrist):
+    """
+    Chữ ký Zobrist của nước đi old_assign -> new_assign (hai mảng int (L, T)).
+
+    zobrist : uint64 (2, L * T, S + 1)
+        Số ngẫu nhiên theo (mã cũ / mã mới, ô phẳng, style ID + 1); cột 0 là ô trống.
+
+    Returns
+    -------
+    uint64
+        XOR các số của mọi ô thay đổi (không phụ thuộc thứ tự duyệt).
+    """
+    old_flat = old_assign.ravel()
+    new_flat = new_assign.ravel()
+    signature = np.uint64(0)
+    for k in range(old_flat.shape[0]):
+        if old_flat[k] != new_flat[k]:
+            signature ^= zobrist[0, k, old_flat[k] + 1] ^ zobrist[1, k, new_flat[k] + 1]
+    return signature
+
+
+def warmup(dtype=np.float64):
+    """
+    Biên dịch trước `simulate` / `move_signature` trên một bài toán giả 1 line x 1 style x 1 ngày.
+
+    Gọi trong tiến trình cha trước khi fork các worker (Multi-Start) để mọi
+    worker dùng chung bản đã biên dịch thay vì mỗi tiến trình tự JIT/nạp cache.
+    Kiểu dữ liệu phải khớp với mảng do ALNSOperator._precompute_data tạo ra.
+
+    Parameters
+    ----------
+    dtype : numpy dtype
+        Kiểu số thực của mảng mô phỏng (float_dtype của ALNSOperator); mỗi
+        kiểu là một bản biên dịch riêng của `simulate`.
+    """
+    if not HAS_NUMBA:
+        return
+    n = 1
+    fd = dtype
+    simulate(
+        np.zeros((n, n), dtype=np.int32), 0, np.inf, 0,
+        np.zeros((n, n), dtype=fd), np.zeros((n, n), dtype=fd), np.zeros((n, n), dtype=np.bool_),
+        np.zeros((n, n), dtype=fd), np.zeros((n, n), dtype=fd), np.zeros(n, dtype=fd),
+        np.zeros((n, n + 1), dtype=fd), np.zeros((n, n), dtype=np.int32), np.zeros((n, 2, n), dtype=fd),
+        np.zeros((n, 3, n), dtype=fd), np.zeros((n, 3)),
+        np.ones(n, dtype=np.int64), np.full(n, -1, dtype=np.int32), np.zeros(n, dtype=fd),
+        np.ones((n, n), dtype=np.bool_), np.ones((n, n), dtype=fd), np.ones(n, dtype=fd),
+        np.zeros(n, dtype=np.int64), np.zeros(n, dtype=fd),
+        np.zeros((n, n + 1), dtype=fd), np.zeros((n, n + 1), dtype=fd), np.zeros(n, dtype=fd),
+        np.zeros(n, dtype=fd), np.zeros(n, dtype=fd),
+        np.zeros((n, n), dtype=fd), np.zeros((n, n), dtype=np.bool_), np.zeros((n, n), dtype=np.int32),
+        np.ones(n, dtype=np.int32), np.ones(n, dtype=fd), np.ones(n + 1, dtype=fd), np.zeros(n + 1), 0.0, 0.0,
+    )
+    move_signature(np.zeros((n, n), dtype=np.int32), np.zeros((n, n), dtype=np.int32),
+                   np.zeros((2, n, n + 1), dtype=np.uint64))
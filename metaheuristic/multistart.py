@@ -0,0 +1,86 @@
+import os
+import queue
+import multiprocessing
+
+import numpy as np
+
+from ._fastops import warmup
+from .tabu_search import TabuSearchSolver
+
+
+class EliteExchange:
+    """
+    Kênh trao đổi lời giải tốt nhất giữa các tiến trình Tabu Search.
+
+    Mỗi worker có một hộp thư (inbox) riêng; khi publish, lời giải được gửi
+    vào hộp thư của tất cả worker khác. Cả gửi và nhận đều không chặn
+    (non-blocking) để các worker không phải chờ nhau.
+    """
+
+    def __init__(self, inbox, outboxes):
+        self.inbox = inbox
+        self.outboxes = outboxes
+
+    def publish(self, cost, assignment):
+        for box in self.outboxes:
+            try:
+                box.put_nowait((cost, assignment))
+            except queue.Full:
+                pass
+
+    def poll(self):
+        """Lấy lời giải tốt nhất đang chờ trong inbox, None nếu không có."""
+        best = None
+        while True:
+            try:
+                cost, assignment = self.inbox.get_nowait()
+            except queue.Empty:
+                return best
+            if best is None or cost < best[0]:
+                best = (cost, assignment)
+
+
+def _run_worker(args):
+    input_data, seed, exchange, solver_kwargs = args
+    solver = TabuSearchSolver(input_data, seed=seed, elite_exchange=exchange, **solver_kwargs)
+    solution = solver.solve()
+    return solution['total_cost'], solution
+
+
+def solve_multistart(input_data, n_starts=None, max_iter=1000, base_seed=0, **solver_kwargs):
+    """
+    Parallel Multi-Start Tabu Search.
+
+    Chạy n_starts solver độc lập (seed khác nhau) trên các tiến trình riêng,
+    mỗi solver được trọn max_iter vòng lặp (vẫn bị giới hạn bởi max_time nếu
+    truyền vào), tức là cùng ngân sách thời gian với một solver đơn nhưng dùng
+    nhiều core hơn. Các solver định kỳ trao đổi lời giải tốt nhất qua EliteExchange.
+
+    Returns
+    -------
+    dict
+        Lời giải tốt nhất (dạng String keys, giống TabuSearchSolver.solve()).
+    """
+    n_starts = n_starts or os.cpu_count() or 1
+    # Mỗi tiến trình đã chiếm một core -> không mở thêm thread đánh giá
+    solver_kwargs.setdefault('n_workers', 1)
+
+    # Biên dịch kernel một lần ở tiến trình cha (đúng kiểu số thực solver sẽ dùng);
+    # các worker fork ra dùng lại luôn
+    warmup(solver_kwargs.get('float_dtype', np.float64))
+
+    with multiprocessing.Manager() as manager:
+        inboxes = [manager.Queue() for _ in range(n_starts)]
+        tasks = []
+        for k in range(n_starts):
+            exchange = EliteExchange(inboxes[k], [box for j, box in enumerate(inboxes) if j != k])
+            kwargs = dict(solver_kwargs, max_iter=max_iter)
+            tasks.append((input_data, base_seed + k, exchange, kwargs))
+
+        with multiprocessing.Pool(n_starts) as pool:
+            results = pool.map(_run_worker, tasks)
+
+    best_cost, best_solution = min(results, key=lambda r: r[0])
+    print(f"\n[MultiStart] Chi phí theo từng seed: {[f'{c:,.0f}' for c, _ in results]}")
+    print(f"[MultiStart] Chi phí tốt nhất: {best_cost:,.2f}")
+    return best_solution
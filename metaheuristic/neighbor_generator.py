@@ -1,5 +1,5 @@
-import copy
 import random
+import numpy as np
 
 class NeighborGenerator:
     """
@@ -12,8 +12,14 @@ class NeighborGenerator:
         # cap_map ở đây chỉ dùng để tham chiếu list lines/times
         self.lines = list(self.input.set['setL'])
         self.times = sorted(list(self.input.set['setT']))
-
-    def generate_neighbors(self, base_solution, mo_probability, evaluator):
+        self.time_to_idx = {t: i for i, t in enumerate(self.times)}
+        # RNG NumPy để bốc số ngẫu nhiên cho cả lô nước đi một lần (seed lấy từ `random`
+        # nên vẫn tất định khi solver đặt seed)
+        self.rng = np.random.default_rng(random.getrandbits(64))
+        # Số láng giềng truyền thống mặc định mỗi vòng (Logic cũ)
+        self.num_traditional = max(len(self.lines) * 2, 10)
+
+    def generate_neighbors(self, base_solution, mo_probability, evaluator, budget=None):
         """
         Sinh danh sách các giải pháp láng giềng.
         
@@ -23,68 +29,82 @@ class NeighborGenerator:
             Xác suất để kích hoạt các toán tử Multi-Objective (thông minh).
         evaluator : ALNSOperator
             Dùng để kiểm tra ràng buộc (bitmask) và tính toán chi phí (fast fail).
+        budget : int, optional
+            Số nước đi truyền thống cần sinh (None = self.num_traditional).
         """
-        neighbors = []
+        candidates = []
         
         # 1. Luôn sinh các láng giềng truyền thống (Swap, Reassign)
-        traditional = self._generate_traditional_neighbors(base_solution, evaluator)
-        neighbors.extend(traditional)
+        traditional = self._generate_traditional_neighbors(base_solution, evaluator, budget)
+        candidates.extend(traditional)
         
         # 2. Sinh láng giềng thông minh (MO) dựa trên xác suất
         if random.random() < mo_probability:
             mo_neighbors = self._generate_multi_objective_neighbors(base_solution, evaluator)
-            neighbors.extend(mo_neighbors)
+            candidates.extend(mo_neighbors)
             
-        return neighbors
+        # 3. Các láng giềng độc lập nhau -> đánh giá một lượt (song song),
+        #    mỗi láng giềng chỉ mô phỏng lại từ ngày bị thay đổi so với base
+        return evaluator.evaluate_batch(candidates, base=base_solution)
 
     # =================================================================
     #  TRADITIONAL MOVES
     # =================================================================
-    def _generate_traditional_neighbors(self, base_solution, evaluator):
+    # Assignment là mảng (L, T): hàng = line (theo self.lines), cột = time index
+    def _generate_traditional_neighbors(self, base_solution, evaluator, budget=None):
         neighbors = []
         base_assign = base_solution['assignment']
-        num_neighbors = max(len(self.lines) * 2, 10) # Logic cũ
-
-        for _ in range(num_neighbors):
-            move_type = random.choice(['swap', 'reassign_block', 'reassign_single'])
-            
-            # Shallow copy là đủ nhanh
-            new_assign = copy.copy(base_assign)
-            l = random.choice(self.lines)
+        num_lines, num_times = base_assign.shape
+        num_neighbors = self.num_traditional if budget is None else budget
+
+        # Bốc trước toàn bộ số ngẫu nhiên cho lô: loại nước đi, line, và 3 số đều
+        # [0, 1) cho từng nước (vị trí / độ dài block / style tùy loại)
+        move_types = self.rng.integers(0, 3, num_neighbors)  # 0 = swap, 1 = block, 2 = single
+        line_ids = self.rng.integers(0, num_lines, num_neighbors)
+        u = self.rng.random((num_neighbors, 3))
+
+        # Style hợp lệ ngẫu nhiên theo line (allowed_ids đệm -1 -> line không có mã nào nhận -1)
+        allowed_ids = evaluator.precomputed['allowed_ids']
+        counts = evaluator.precomputed['allowed_count'][line_ids]
+        new_styles = allowed_ids[line_ids, (u[:, 2] * counts).astype(np.int64)].tolist()
+
+        max_block = max(2, num_times // 4)
+        for move, i, (u0, u1, _), new_style_id in zip(move_types.tolist(), line_ids.tolist(),
+                                                     u.tolist(), new_styles):
+            # Copy mảng (L, T) là đủ nhanh
+            new_assign = base_assign.copy()
+            row = new_assign[i]
 
             changed = False
             
-            if move_type == 'swap' and len(self.times) >= 2:
-                t1, t2 = random.sample(self.times, 2)
-                if new_assign[(l, t1)] != new_assign[(l, t2)]:
-                    new_assign[(l, t1)], new_assign[(l, t2)] = new_assign[(l, t2)], new_assign[(l, t1)]
+            if move == 0 and num_times >= 2:
+                # Swap 2 ngày khác nhau trên cùng line
+                j1 = int(u0 * num_times)
+                j2 = int(u1 * (num_times - 1))
+                j2 += j2 >= j1
+                if row[j1] != row[j2]:
+                    row[j1], row[j2] = row[j2], row[j1]
                     changed = True
 
-            elif move_type == 'reassign_block' and len(self.times) > 5:
-                block_size = random.randint(2, max(2, len(self.times) // 4))
-                start_idx = random.randint(0, len(self.times) - block_size)
-                
-                # Gọi evaluator để lấy random ID hợp lệ (O(1))
-                new_style_id = evaluator._random_allowed_style_id(l)
+            elif move == 1 and num_times > 5:
+                block_size = 2 + int(u0 * (max_block - 1))
+                start_idx = int(u1 * (num_times - block_size + 1))
                 
-                if new_style_id is not None:
-                    for i in range(block_size):
-                        t = self.times[start_idx + i]
-                        if new_assign[(l, t)] != new_style_id:
-                            new_assign[(l, t)] = new_style_id
-                            changed = True
+                if new_style_id >= 0:
+                    block = row[start_idx:start_idx + block_size]
+                    if (block != new_style_id).any():
+                        block[:] = new_style_id
+                        changed = True
 
             else:  # reassign_single
-                t = random.choice(self.times)
-                new_style_id = evaluator._random_allowed_style_id(l)
-                
-                if new_style_id is not None and new_style_id != new_assign[(l, t)]:
-                    new_assign[(l, t)] = new_style_id
+                j = int(u0 * num_times)
+                if new_style_id >= 0 and new_style_id != row[j]:
+                    row[j] = new_style_id
                     changed = True
 
             if changed:
                 # Không cần tag origin_operator nữa vì đã bỏ RL
-                neighbors.append(evaluator.repair_and_evaluate({'assignment': new_assign}))
+                neighbors.append({'assignment': new_assign})
 
         return neighbors
 
@@ -114,20 +134,19 @@ class NeighborGenerator:
         current_assign = base_solution['assignment']
         attempts = 0
         
-        for l in self.lines:
-            segments = self._find_short_segments(l, current_assign)
+        for i, l in enumerate(self.lines):
+            segments = self._find_short_segments(current_assign[i])
             if not segments: continue
             
             # Thử nối 2 segment ngắn ngẫu nhiên
             for segment in random.sample(segments, min(len(segments), 2)):
-                dominant_id = self._get_dominant_neighbor_style(l, segment, current_assign)
+                dominant_id = self._get_dominant_neighbor_style(current_assign[i], segment)
                 
                 # Check ID hợp lệ bằng bitmask của evaluator
-                if dominant_id is not None and evaluator._is_allowed(l, dominant_id):
-                    new_assign = copy.copy(current_assign)
-                    for t in segment['periods']:
-                        new_assign[(l, t)] = dominant_id
-                    moves.append(evaluator.repair_and_evaluate({'assignment': new_assign}))
+                if dominant_id is not None and evaluator.allowed_mat[i, dominant_id]:
+                    new_assign = current_assign.copy()
+                    new_assign[i, segment['start']:segment['end'] + 1] = dominant_id
+                    moves.append({'assignment': new_assign})
                     attempts += 1
             if attempts >= 5: break
         return moves
@@ -140,21 +159,22 @@ class NeighborGenerator:
         high_risk_ids = self._identify_high_risk_styles(base_solution)
         if not high_risk_ids: return []
 
+        num_times = len(self.times)
         # Lấy top 3 style trễ nhất
         for s_id in high_risk_ids[:3]:
-            # Tìm các vị trí khả dĩ để chèn
-            valid_slots = [
-                (l, t) for l in self.lines for t in self.times
-                if evaluator._is_allowed(l, s_id) and current_assign.get((l, t)) != s_id
-            ]
+            # final_backlog đánh key theo tên style nên không khớp ID nào (giữ hành vi cũ:
+            # bật toán tử này làm kết quả StandardInput xấu đi)
+            if s_id not in evaluator.id_to_style: continue
+            # Vị trí khả dĩ để chèn: line được phép may s_id và ô chưa gán s_id (chỉ số phẳng)
+            valid_slots = np.flatnonzero(evaluator.allowed_mat[:, s_id, None] & (current_assign != s_id))
             
-            if valid_slots:
+            if len(valid_slots):
                 # Chèn thử vào 3 vị trí ngẫu nhiên
                 for _ in range(min(3, len(valid_slots))):
-                    l, t = random.choice(valid_slots)
-                    new_assign = copy.copy(current_assign)
-                    new_assign[(l, t)] = s_id
-                    moves.append(evaluator.repair_and_evaluate({'assignment': new_assign}))
+                    i, j = divmod(int(valid_slots[random.randrange(len(valid_slots))]), num_times)
+                    new_assign = current_assign.copy()
+                    new_assign[i, j] = s_id
+                    moves.append({'assignment': new_assign})
         return moves
 
     def _gen_balanced(self, base_solution, evaluator):
@@ -162,48 +182,39 @@ class NeighborGenerator:
         current_assign = base_solution['assignment']
         
         for _ in range(5): # Thử 5 lần swap chiến lược
-            l = random.choice(self.lines)
+            i = random.randrange(len(self.lines))
             if len(self.times) < 2: continue
-            t1, t2 = random.sample(self.times, 2)
+            j1, j2 = random.sample(range(len(self.times)), 2)
             
             # Chỉ swap nếu khác nhau
-            if current_assign[(l, t1)] != current_assign[(l, t2)]:
-                new_assign = copy.copy(current_assign)
-                new_assign[(l, t1)], new_assign[(l, t2)] = new_assign[(l, t2)], new_assign[(l, t1)]
-                moves.append(evaluator.repair_and_evaluate({'assignment': new_assign}))
+            if current_assign[i, j1] != current_assign[i, j2]:
+                new_assign = current_assign.copy()
+                new_assign[i, j1], new_assign[i, j2] = new_assign[i, j2], new_assign[i, j1]
+                moves.append({'assignment': new_assign})
         return moves
 
     # --- HELPERS ---
-    def _find_short_segments(self, line, assignment):
+    def _find_short_segments(self, row):
+        """Các đoạn liên tiếp cùng mã trên một hàng assignment, chỉ giữ đoạn <= 3 ngày."""
         segments = []
-        current_style = None
-        current_segment = []
-        
-        for t in self.times:
-            style = assignment.get((line, t))
-            if style != current_style:
-                if current_segment: segments.append({'style': current_style, 'periods': current_segment})
-                current_style = style
-                current_segment = [t]
-            else:
-                current_segment.append(t)
-        if current_segment: segments.append({'style': current_style, 'periods': current_segment})
-        # Lọc các đoạn ngắn <= 3 ngày
-        return [s for s in segments if len(s['periods']) <= 3]
-
-    def _get_dominant_neighbor_style(self, line, segment, assignment):
-        start_t = min(segment['periods'])
-        end_t = max(segment['periods'])
-        try:
-            start_idx = self.times.index(start_t)
-            end_idx = self.times.index(end_t)
-        except ValueError: return None
-
-        prev = assignment.get((line, self.times[start_idx-1])) if start_idx > 0 else None
-        nxt = assignment.get((line, self.times[end_idx+1])) if end_idx < len(self.times) - 1 else None
+        # Vị trí bắt đầu đoạn mới: cột 0 và mọi cột khác mã với cột trước
+        starts = [0] + (np.flatnonzero(row[1:] != row[:-1]) + 1).tolist() if len(row) else []
+        ends = starts[1:] + [len(row)]
+        for start, end in zip(starts, ends):
+            # Lọc các đoạn ngắn <= 3 ngày
+            if end - start <= 3:
+                segments.append({'style': int(row[start]), 'start': start, 'end': end - 1})
+        return segments
+
+    def _get_dominant_neighbor_style(self, row, segment):
+        start_idx, end_idx = segment['start'], segment['end']
+        prev = int(row[start_idx - 1]) if start_idx > 0 else -1
+        nxt = int(row[end_idx + 1]) if end_idx < len(row) - 1 else -1
         
-        if prev is not None and prev == nxt: return prev
-        return prev if prev is not None else nxt
+        # -1 = ô trống (không có mã)
+        if prev >= 0 and prev == nxt: return prev
+        if prev >= 0: return prev
+        return nxt if nxt >= 0 else None
 
     def _identify_high_risk_styles(self, solution):
         # Trả về list ID style
@@ -1,5 +1,5 @@
 import random
-import copy
+import numpy as np
 
 class StrategicOscillationHandler:
     def __init__(self, input_data, evaluator):
@@ -7,52 +7,53 @@ class StrategicOscillationHandler:
         self.evaluator = evaluator
         self.lines = list(self.input.set['setL'])
         self.times = sorted(list(self.input.set['setT']))
+        # RNG NumPy để bốc cả loạt ô bị xáo trộn một lần (seed lấy từ `random`)
+        self.rng = np.random.default_rng(random.getrandbits(64))
+        # Danh sách line may được từng style (theo ID), dựng một lần cho aggressive_repair
+        self.capable_lines = [np.flatnonzero(col).tolist() for col in self.evaluator.allowed_mat.T]
 
     def explore_infeasible_region(self, current_solution):
         """
         [RELAX] Tạo ra giải pháp vi phạm ràng buộc.
         Mục tiêu: Đẩy các style đang bị trễ (backlog) vào lịch sản xuất bất chấp capability.
         """
-        shaken_solution = copy.deepcopy(current_solution)
+        # Chỉ assignment bị sửa -> copy nông solution, copy riêng mảng assignment
+        shaken_solution = dict(current_solution, assignment=current_solution['assignment'].copy())
         assignment = shaken_solution['assignment']
         
-        # Lấy danh sách style đang bị backlog (đổi tên sang ID)
-        backlog_map = current_solution.get('final_backlog', {})
-        high_risk_ids = []
-        for s_name, qty in backlog_map.items():
-            if qty > 0:
-                s_id = self.evaluator.style_to_id.get(s_name)
-                if s_id is not None:
-                    high_risk_ids.append(s_id)
+        # Lấy danh sách style (ID) đang bị backlog thẳng từ mảng backlog cuối kỳ
+        arrays = current_solution.get('sim_arrays')
+        if arrays is not None:
+            high_risk_ids = np.flatnonzero(arrays['backlog'] > 0)
+        else:
+            backlog_map = current_solution.get('final_backlog', {})
+            high_risk_ids = [self.evaluator.style_to_id[s_name] for s_name, qty in backlog_map.items()
+                             if qty > 0 and s_name in self.evaluator.style_to_id]
         
         # Nếu không có backlog thì quậy ngẫu nhiên
-        if not high_risk_ids:
+        if len(high_risk_ids) == 0:
             return self._random_perturbation(shaken_solution)
 
         # Ép style bị trễ vào các vị trí ngẫu nhiên (Infeasible Injection)
         # Số lượng thay đổi khoảng 5-8% tổng số slot
         num_changes = max(5, int(len(self.lines) * len(self.times) * 0.08))
         
-        for _ in range(num_changes):
-            l = random.choice(self.lines)
-            t = random.choice(self.times)
-            s_forced = random.choice(high_risk_ids)
-            
-            # Gán trực tiếp, bỏ qua kiểm tra _is_allowed
-            assignment[(l, t)] = s_forced
+        rows = self.rng.integers(0, len(self.lines), num_changes)
+        cols = self.rng.integers(0, len(self.times), num_changes)
+        
+        # Gán trực tiếp, bỏ qua kiểm tra _is_allowed
+        assignment[rows, cols] = self.rng.choice(high_risk_ids, num_changes)
             
         return shaken_solution
 
     def _random_perturbation(self, solution):
         """Đảo lộn ngẫu nhiên khi không có backlog để phá vỡ cấu trúc hiện tại."""
         assignment = solution['assignment']
-        all_style_ids = list(self.evaluator.style_to_id.values())
+        num_changes = 15
         
-        for _ in range(15):
-            l = random.choice(self.lines)
-            t = random.choice(self.times)
-            s_id = random.choice(all_style_ids)
-            assignment[(l, t)] = s_id
+        rows = self.rng.integers(0, len(self.lines), num_changes)
+        cols = self.rng.integers(0, len(self.times), num_changes)
+        assignment[rows, cols] = self.rng.integers(0, len(self.evaluator.style_to_id), num_changes)
         return solution
 
     def aggressive_repair(self, infeasible_solution):
@@ -61,44 +62,52 @@ class StrategicOscillationHandler:
         Logic: Nếu Line A giữ Style X (sai), tìm Line B (đúng) để swap X sang,
         kể cả khi phải đẩy Style Y của Line B ra ngoài.
         """
-        repaired_assign = copy.deepcopy(infeasible_solution['assignment'])
+        repaired_assign = infeasible_solution['assignment'].copy()
+        allowed = self.evaluator.allowed_mat
+        num_styles = allowed.shape[1]
         
-        # Duyệt qua toàn bộ lưới
-        for l in self.lines:
-            for t in self.times:
-                s_id = repaired_assign.get((l, t))
+        # Các ô vi phạm ban đầu (Line l không may được Style s_id; -1 = ô trống), theo thứ tự
+        # line, time. Swap chỉ ghi mã hợp lệ nên không tạo ô vi phạm mới, nhưng có thể đã
+        # sửa một ô phía sau -> kiểm tra lại khi tới lượt.
+        in_range = (repaired_assign >= 0) & (repaired_assign < num_styles)
+        violated = (repaired_assign >= num_styles) | (
+            in_range & ~allowed[np.arange(len(self.lines))[:, None], np.where(in_range, repaired_assign, 0)])
+        for i, j in zip(*np.nonzero(violated)):
+            l = self.lines[i]
+            s_id = int(repaired_assign[i, j])
+            if s_id < 0 or (s_id < num_styles and allowed[i, s_id]):
+                continue
+            
+            # Tìm "cứu viện": Các line khác có thể may s_id tại thời điểm t
+            candidates = ([ci for ci in self.capable_lines[s_id] if ci != i]
+                          if s_id < num_styles else [])
+            
+            fixed = False
+            if candidates:
+                # Chọn ngẫu nhiên một người cứu viện
+                i_target = random.choice(candidates)
+                s_target_current = int(repaired_assign[i_target, j])
                 
-                # Nếu gặp vị trí vi phạm (Line l không may được Style s_id)
-                if s_id is not None and not self.evaluator._is_allowed(l, s_id):
-                    
-                    # Tìm "cứu viện": Các line khác có thể may s_id tại thời điểm t
-                    candidates = [
-                        cl for cl in self.lines 
-                        if cl != l and self.evaluator._is_allowed(cl, s_id)
-                    ]
-                    
-                    fixed = False
-                    if candidates:
-                        # Chọn ngẫu nhiên một người cứu viện
-                        l_target = random.choice(candidates)
-                        s_target_current = repaired_assign.get((l_target, t))
-                        
-                        # -- SWAP --
-                        # 1. Đưa hàng sai (s_id) sang chỗ đúng (l_target)
-                        repaired_assign[(l_target, t)] = s_id
-                        
-                        # 2. Xử lý hàng bị đẩy ra (s_target_current)
-                        # Nếu l làm được s_target_current thì đổi chéo, không thì random
-                        if s_target_current is not None and self.evaluator._is_allowed(l, s_target_current):
-                            repaired_assign[(l, t)] = s_target_current
-                        else:
-                            repaired_assign[(l, t)] = self.evaluator._random_allowed_style_id(l)
-                        
-                        fixed = True
-                    
-                    if not fixed:
-                        # Nếu không ai cứu được, đành xóa style vi phạm đi, gán style random hợp lệ cho l
-                        repaired_assign[(l, t)] = self.evaluator._random_allowed_style_id(l)
+                # -- SWAP --
+                # 1. Đưa hàng sai (s_id) sang chỗ đúng (l_target)
+                repaired_assign[i_target, j] = s_id
+                
+                # 2. Xử lý hàng bị đẩy ra (s_target_current)
+                # Nếu l làm được s_target_current thì đổi chéo, không thì random
+                if s_target_current >= 0 and allowed[i, s_target_current]:
+                    repaired_assign[i, j] = s_target_current
+                else:
+                    repaired_assign[i, j] = self._random_allowed_or_empty(l)
+                
+                fixed = True
+            
+            if not fixed:
+                # Nếu không ai cứu được, đành xóa style vi phạm đi, gán style random hợp lệ cho l
+                repaired_assign[i, j] = self._random_allowed_or_empty(l)
 
         # Tính toán lại chi phí sau khi đã sửa xong cấu trúc
         return self.evaluator.repair_and_evaluate({'assignment': repaired_assign})
+
+    def _random_allowed_or_empty(self, line):
+        s_id = self.evaluator._random_allowed_style_id(line)
+        return -1 if s_id is None else s_id
@@ -1,23 +1,37 @@
 import time
-import copy
+import math
 from collections import deque, defaultdict
 import random
+import numpy as np
 
 # Import các module nội bộ
 from .neighbor_generator import NeighborGenerator
 from .ALNS_operator import ALNSOperator
 from .oscillation_strategy import StrategicOscillationHandler
+from ._fastops import move_signature
 
 class TabuSearchSolver:
     def __init__(self, input_data, discount_alpha=0.05, initial_line_df=None, max_iter=1000, 
                  tabu_tenure=15, max_time=1200, min_tenure=5, max_tenure=40, 
-                 increase_threshold=50, decrease_threshold=10, verbose=True):
+                 increase_threshold=50, decrease_threshold=10, verbose=True,
+                 n_workers=None, seed=None, elite_exchange=None, exchange_interval=100,
+                 float_dtype=np.float64, eval_cache_size=0, adaptive_neighborhood=False):
         
+        # Seed riêng cho từng solver (Multi-Start), phải đặt trước khi tạo lời giải ban đầu
+        if seed is not None:
+            random.seed(seed)
+            np.random.seed(seed)
+
         self.input = input_data
         self.alpha = discount_alpha
         self.max_iter = max_iter
         self.max_time = max_time
         self.verbose = verbose
+
+        # --- ELITE EXCHANGE (Multi-Start) ---
+        self.elite_exchange = elite_exchange
+        self.exchange_interval = exchange_interval
+        self.last_published_cost = float('inf')
         
         # --- TABU PARAMETERS ---
         self.current_tenure = tabu_tenure
@@ -25,7 +39,9 @@ class TabuSearchSolver:
         self.max_tenure = max_tenure
         self.increase_threshold = increase_threshold
         self.decrease_threshold = decrease_threshold
-        self.tabu_list = deque(maxlen=self.current_tenure)
+        # Tabu list = hàng đợi FIFO các chữ ký + bộ đếm chữ ký đang bị cấm (kiểm tra O(1))
+        self.tabu_list = deque()
+        self.tabu_counts = defaultdict(int)
         
         # --- ADAPTIVE TRACKING ---
         self.no_improvement_counter = 0
@@ -33,6 +49,9 @@ class TabuSearchSolver:
         self.mo_probability = 0.5  # Xác suất chạy Multi-Objective move
         self.mo_moves_attempted = 0
         self.mo_moves_accepted_as_best = 0
+        # Kích thước vùng láng giềng thích nghi (None = luôn sinh đủ số nước đi mặc định)
+        self.adaptive_neighborhood = adaptive_neighborhood
+        self.neighbor_budget = None
 
         # --- SETUP CAPABILITY MAP ---
         # Map này dùng để NeighborGenerator biết Line nào làm được gì
@@ -48,21 +67,45 @@ class TabuSearchSolver:
 
         # --- INITIALIZE COMPONENTS ---
         # 1. Evaluator: Tính toán chi phí, check ràng buộc (Core logic)
-        self.evaluator = ALNSOperator(input_data, self.cap_map, discount_alpha)
+        #    n_workers: số thread đánh giá láng giềng song song (None = số CPU)
+        #    float_dtype: np.float32 để giảm một nửa bộ nhớ mảng mô phỏng (sai số ~1e-7)
+        #    eval_cache_size: số kết quả mô phỏng giữ lại theo assignment (0 = không cache)
+        self.evaluator = ALNSOperator(input_data, self.cap_map, discount_alpha,
+                                      n_workers=n_workers, float_dtype=float_dtype,
+                                      cache_size=eval_cache_size)
         
         # 2. Generator: Sinh láng giềng
         self.neighbor_gen = NeighborGenerator(input_data, self.cap_map)
         
         # 3. Oscillation: Xử lý phá vỡ rào cản (Infeasible -> Feasible)
         self.oscillation_handler = StrategicOscillationHandler(input_data, self.evaluator)
+        if self.adaptive_neighborhood:
+            self.neighbor_budget = self.neighbor_gen.num_traditional
+
+        # 4. Bảng Zobrist cho chữ ký nước đi: mỗi (ô phẳng line*T + time, style) một số 64-bit
+        #    ngẫu nhiên, riêng cho mã cũ và mã mới; cột style đầu tiên dành cho ô trống (-1).
+        #    RNG riêng seed cố định nên không ảnh hưởng chuỗi ngẫu nhiên của thuật toán.
+        self._zobrist = np.random.default_rng(0).integers(
+            0, 2**63, size=(2, len(self.evaluator.lines) * len(self.evaluator.times),
+                            len(self.evaluator.style_to_id) + 1), dtype=np.uint64)
 
         # --- INITIAL SOLUTION ---
         print("Đang tạo giải pháp ban đầu...")
         self.current_solution = self.evaluator.initialize_solution()
-        self.best_solution = copy.deepcopy(self.current_solution)
+        self.best_solution = self._snapshot(self.current_solution)
         self.best_cost = self.current_solution['total_cost']
-        self.costs = [self.best_cost]
-        self.start_time = time.time()
+        # Lịch sử chi phí current theo vòng lặp: cấp phát sẵn, ghi theo chỉ số (xem property costs)
+        self._costs = np.empty(self.max_iter + 1, dtype=np.float64)
+        self._costs[0] = self.best_cost
+        self._num_costs = 1
+        # Đồng hồ monotonic: không bị ảnh hưởng khi giờ hệ thống bị chỉnh
+        self.start_time = time.monotonic()
+        self._deadline = self.start_time + self.max_time
+
+    @property
+    def costs(self):
+        """Chi phí current sau mỗi vòng lặp (phần tử đầu = lời giải ban đầu), dạng view ndarray."""
+        return self._costs[:self._num_costs]
 
     def solve(self):
         print(f"\n--- BẮT ĐẦU TỐI ƯU HÓA ---")
@@ -76,10 +119,14 @@ class TabuSearchSolver:
             last_iter = i
             
             # 1. Kiểm tra thời gian
-            if time.time() - self.start_time > self.max_time:
+            if time.monotonic() > self._deadline:
                 print(f"\n[STOP] Đã đạt giới hạn thời gian tại vòng lặp {i}.")
                 break
 
+            # Trao đổi lời giải tốt nhất với các solver khác (nếu chạy Multi-Start)
+            if self.elite_exchange is not None and i % self.exchange_interval == 0:
+                self._exchange_elites(i)
+
             # 2. Cập nhật Fast Fail cho Evaluator
             self.evaluator.set_pruning_best(self.best_cost)
 
@@ -102,7 +149,8 @@ class TabuSearchSolver:
             neighbors = self.neighbor_gen.generate_neighbors(
                 self.current_solution, 
                 self.mo_probability, 
-                self.evaluator
+                self.evaluator,
+                budget=self.neighbor_budget
             )
             
             if not neighbors:
@@ -123,7 +171,7 @@ class TabuSearchSolver:
                 
                 # Aspiration Criteria: Nếu tốt hơn Best Global -> Bỏ qua Tabu
                 is_aspiration = cost < self.best_cost
-                is_tabu = move_signature in self.tabu_list
+                is_tabu = move_signature in self.tabu_counts
                 
                 if is_aspiration or not is_tabu:
                     best_neighbor = neighbor
@@ -131,11 +179,11 @@ class TabuSearchSolver:
                     chosen_move_is_mo = (neighbor.get('type') == 'mo_move')
                     
                     # Cập nhật Tabu List
-                    self.tabu_list.append(move_signature)
+                    self._tabu_push(move_signature)
                     
                     # Cập nhật Best Global nếu cần
                     if is_aspiration:
-                        self.best_solution = copy.deepcopy(neighbor)
+                        self.best_solution = self._snapshot(neighbor)
                         self.best_cost = cost
                         self._on_improvement(i, cost, source="TabuSearch")
                     else:
@@ -154,12 +202,14 @@ class TabuSearchSolver:
                 # Vẫn tính là không cải thiện global
                 self._on_no_improvement()
 
-            self.costs.append(self.current_solution['total_cost'])
+            self._costs[self._num_costs] = self.current_solution['total_cost']
+            self._num_costs += 1
 
             # ==========================================================
             # C. CẬP NHẬT CHIẾN THUẬT (ADAPTIVE STRATEGY)
             # ==========================================================
-            self._update_mo_strategy(chosen_move_is_mo, found_valid_move and best_neighbor['total_cost'] < self.costs[-2] if len(self.costs)>1 else False)
+            self._update_mo_strategy(chosen_move_is_mo, found_valid_move and best_neighbor['total_cost'] < self._costs[self._num_costs - 2])
+            self._update_neighbor_budget()
             self._update_tenure()
 
             # Logging định kỳ
@@ -190,13 +240,13 @@ class TabuSearchSolver:
         # 3. Đánh giá
         if cost_new < self.best_cost:
             # Tìm thấy kỷ lục mới nhờ Oscillation
-            self.best_solution = copy.deepcopy(feasible_sol)
+            self.best_solution = self._snapshot(feasible_sol)
             self.best_cost = cost_new
             self.current_solution = feasible_sol
             self._on_improvement(iter_idx, cost_new, source="Oscillation")
             
             # Reset Tabu List để tự do khai thác vùng đất mới này
-            self.tabu_list.clear()
+            self._tabu_clear()
             improved = True
             
         elif self.no_improvement_counter > 200:
@@ -207,12 +257,39 @@ class TabuSearchSolver:
                 if self.verbose:
                     print(f"  >> [Oscillation] Chấp nhận giải pháp thay thế để thoát bế tắc (Cost: {cost_new:,.0f}).")
                 self.current_solution = feasible_sol
-                self.tabu_list.clear()
+                self._tabu_clear()
                 self.no_improvement_counter = 50 # Reset một phần
                 improved = True # Trả về True để báo main loop skip neighbor search vòng này
 
         return improved
 
+    def _exchange_elites(self, iter_idx):
+        """Gửi best hiện tại (nếu mới) và nhận elite từ các solver khác (non-blocking)."""
+        if self.best_cost < self.last_published_cost:
+            self.elite_exchange.publish(self.best_cost, self.best_solution['assignment'].copy())
+            self.last_published_cost = self.best_cost
+
+        received = self.elite_exchange.poll()
+        if received is None or received[0] >= self.best_cost:
+            return
+
+        self.evaluator.set_pruning_best(float('inf'))
+        elite = self.evaluator.repair_and_evaluate({'assignment': received[1].copy()})
+        if elite['total_cost'] < self.best_cost:
+            self.best_solution = self._snapshot(elite)
+            self.best_cost = elite['total_cost']
+            self.current_solution = elite
+            # Không gửi ngược lại lời giải vừa nhận
+            self.last_published_cost = self.best_cost
+            self._tabu_clear()
+            self._on_improvement(iter_idx, self.best_cost, source="Exchange")
+
+    @staticmethod
+    def _snapshot(solution):
+        """Bản lưu của một lời giải đã đánh giá: copy nông dict, chỉ copy riêng mảng assignment
+        (các mảng kết quả trong sim_arrays không bị sửa sau khi đánh giá nên dùng chung được)."""
+        return dict(solution, assignment=solution['assignment'].copy())
+
     def _on_improvement(self, iter_idx, new_cost, source="Tabu"):
         """Xử lý khi tìm thấy giải pháp tốt hơn."""
         print(f"[{source}] Vòng {iter_idx}: Kỷ lục mới! Chi phí: {new_cost:,.2f}")
@@ -224,20 +301,48 @@ class TabuSearchSolver:
         self.no_improvement_counter += 1
         self.consecutive_improvements_counter = 0
 
+    def _tabu_push(self, signature):
+        """Thêm chữ ký vào cuối tabu list, bỏ chữ ký cũ nhất nếu vượt tenure."""
+        self.tabu_list.append(signature)
+        self.tabu_counts[signature] += 1
+        self._tabu_trim()
+
+    def _tabu_trim(self):
+        """Bỏ bớt các chữ ký cũ nhất cho tới khi tabu list không dài hơn tenure hiện tại."""
+        while len(self.tabu_list) > self.current_tenure:
+            old = self.tabu_list.popleft()
+            self.tabu_counts[old] -= 1
+            if not self.tabu_counts[old]:
+                del self.tabu_counts[old]
+
+    def _tabu_clear(self):
+        self.tabu_list.clear()
+        self.tabu_counts.clear()
+
+    def _update_neighbor_budget(self):
+        """Co/giãn số nước đi truyền thống mỗi vòng: giãn khi vừa cải thiện, co khi bế tắc."""
+        if self.neighbor_budget is None:
+            return
+        full = self.neighbor_gen.num_traditional
+        if self.no_improvement_counter == 0:
+            self.neighbor_budget = min(full, math.ceil(self.neighbor_budget * 1.25))
+        elif self.no_improvement_counter == self.increase_threshold // 2:
+            self.neighbor_budget = max(max(5, full // 4), int(self.neighbor_budget * 0.8))
+
     def _update_tenure(self):
         """Điều chỉnh độ dài danh sách cấm (Tabu Tenure) động."""
         if self.consecutive_improvements_counter >= self.decrease_threshold:
             # Đang thuận lợi -> Giảm tenure để khai thác sâu (Intensification)
             if self.current_tenure > self.min_tenure:
                 self.current_tenure -= 1
-                self.tabu_list = deque(self.tabu_list, maxlen=self.current_tenure)
+                self._tabu_trim()
             self.consecutive_improvements_counter = 0
             
         elif self.no_improvement_counter >= self.increase_threshold:
             # Đang bế tắc -> Tăng tenure để đi xa hơn (Diversification)
             if self.current_tenure < self.max_tenure:
                 self.current_tenure += 2
-                self.tabu_list = deque(self.tabu_list, maxlen=self.current_tenure)
+                self._tabu_trim()
             self.no_improvement_counter = 0 # Reset để tránh tăng liên tục quá nhanh
 
     def _update_mo_strategy(self, move_was_mo, move_was_improvement):
@@ -261,21 +366,17 @@ class TabuSearchSolver:
 
     def _get_move_signature(self, old_assign, new_assign):
         """Tạo 'chữ ký' cho nước đi để lưu vào Tabu List.
-        Chữ ký là tập hợp các thay đổi: ((line, date, old_style, new_style), ...)
+        Chữ ký là hash Zobrist (int) của tập thay đổi {(line_idx, time_idx, old_style, new_style)}:
+        XOR các số ngẫu nhiên của từng ô thay đổi, không phụ thuộc thứ tự.
         """
-        changes = []
-        for key, val in old_assign.items():
-            if new_assign[key] != val:
-                changes.append((key, val, new_assign[key]))
-        # Sort để đảm bảo tính nhất quán của tuple
-        return tuple(sorted(changes))
+        return int(move_signature(old_assign, new_assign, self._zobrist))
 
     def _finalize_solution(self, iterations_run):
         print("\n" + "="*50)
         print("TỐI ƯU HÓA HOÀN TẤT")
         print(f"Chi phí tốt nhất: {self.best_cost:,.2f}")
         print(f"Tổng số vòng lặp: {iterations_run}")
-        print(f"Thời gian chạy: {time.time() - self.start_time:.2f}s")
+        print(f"Thời gian chạy: {time.monotonic() - self.start_time:.2f}s")
         print("="*50)
         
         # Tắt cắt tỉa để tính toán chính xác lần cuối
@@ -291,18 +392,23 @@ class TabuSearchSolver:
 
     def print_solution_summary(self, solution=None):
         sol = solution or self.best_solution # solution này nên là dạng String keys (sau khi finalize)
-        if not sol: 
-            print("Chưa có giải pháp nào.")
-            return
-        
-        # Lưu ý: Nếu gọi hàm này trước khi finalize, sol có thể đang dùng ID
-        # Nên check an toàn
-        total = sol.get('total_cost', 0)
-        setup = sol.get('total_setup', 0)
-        late = sol.get('total_late', 0)
-        exp = sol.get('total_exp', 0)
-        
-        print(f"Tổng chi phí: {total:,.2f}")
-        print(f"  - Chi phí Setup: {setup:,.2f}")
-        print(f"  - Phạt trễ hạn:  {late:,.2f}")
-        print(f"  - Thưởng kinh nghiệm: {exp:,.2f}")
+        print_solution_summary(sol)
+
+
+def print_solution_summary(sol):
+    """In tóm tắt chi phí của một giải pháp (dùng chung cho Single/Multi-Start)."""
+    if not sol: 
+        print("Chưa có giải pháp nào.")
+        return
+    
+    # Lưu ý: Nếu gọi hàm này trước khi finalize, sol có thể đang dùng ID
+    # Nên check an toàn
+    total = sol.get('total_cost', 0)
+    setup = sol.get('total_setup', 0)
+    late = sol.get('total_late', 0)
+    exp = sol.get('total_exp', 0)
+    
+    print(f"Tổng chi phí: {total:,.2f}")
+    print(f"  - Chi phí Setup: {setup:,.2f}")
+    print(f"  - Phạt trễ hạn:  {late:,.2f}")
+    print(f"  - Thưởng kinh nghiệm: {exp:,.2f}")
@@ -70,7 +70,7 @@ class MakeColorModel:
         T: List[int] = sorted(d.set["setT"])
         BP = sorted(d.set["setBP"])
         Ssame = d.set["setSsame"]
-        SP = d.set["setSP"]
+        SP = list(d.set["setSP"])  # setSP có thể là StylePairs (lazy)
 
         self.first_t = first_t = T[0]
         self._prev = {t: (T[i - 1] if i > 0 else None) for i, t in enumerate(T)}
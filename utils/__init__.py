@@ -1,7 +1,7 @@
 """
 Utils package
 """
-from .data_loader import InputData, get_dataframe_from_excel
+from .data_loader import InputData, StylePairs, get_dataframe_from_excel
 from .file_handler import (
     save_metaheuristic_result, 
     load_metaheuristic_result,
@@ -14,6 +14,7 @@ from .excel_exporter import export_solution_to_excel
 
 __all__ = [
     'InputData',
+    'StylePairs',
     'get_dataframe_from_excel',
     'save_metaheuristic_result',
     'load_metaheuristic_result',
@@ -1,13 +1,37 @@
+import itertools
 import pandas as pd
 import openpyxl
 from dataclasses import dataclass, field
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterable, List, Optional, Union
 
 @dataclass
 class InputData:
     set: Dict[str, Any] = field(default_factory=dict)
     param: Dict[str, Any] = field(default_factory=dict)
 
+class StylePairs:
+    """
+    Tập tất cả cặp style (s1, s2) dạng lazy: không tạo sẵn |S|² tuple.
+    Hỗ trợ duyệt (theo thứ tự itertools.product), len() và kiểm tra `in`.
+    """
+
+    def __init__(self, styles: Iterable[Any]):
+        self.styles = list(styles)
+        self._members = set(self.styles)
+
+    def __iter__(self):
+        return itertools.product(self.styles, repeat=2)
+
+    def __len__(self) -> int:
+        return len(self.styles) ** 2
+
+    def __contains__(self, pair) -> bool:
+        try:
+            s1, s2 = pair
+        except (TypeError, ValueError):
+            return False
+        return s1 in self._members and s2 in self._members
+
 def clean_column_names(df: pd.DataFrame) -> pd.DataFrame:
     """Chuẩn hóa tên cột: Xóa khoảng trắng thừa, ký tự lạ."""
     if df.columns is not None:
@@ -21,7 +45,7 @@ def clean_column_names(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 def get_dataframe_from_excel(
-    file_path: str, 
+    file_path: Union[str, pd.ExcelFile], 
     sheet_name: str, 
     header: int = 0, 
     expected_columns: Optional[List[str]] = None,
@@ -32,6 +56,9 @@ def get_dataframe_from_excel(
     
     Parameters
     ----------
+    file_path : str hoặc pd.ExcelFile
+        Đường dẫn file, hoặc workbook đã mở sẵn bằng pd.ExcelFile để đọc
+        nhiều sheet mà không phải parse lại file XLSX mỗi lần.
     expected_columns : list
         Danh sách các cột BẮT BUỘC phải có (ví dụ: ['Experience', 'Efficiency']).
         Dùng để tìm dòng header nếu autodetect_header=True.
@@ -83,5 +110,6 @@ def get_dataframe_from_excel(
         print(f"   -> [Loader] Bỏ qua: Không tìm thấy sheet '{sheet_name}'.")
         return pd.DataFrame()
     except Exception as e:
-        print(f"   -> [Loader] Lỗi đọc file {file_path}, sheet {sheet_name}: {e}")
+        source = file_path.io if isinstance(file_path, pd.ExcelFile) else file_path
+        print(f"   -> [Loader] Lỗi đọc file {source}, sheet {sheet_name}: {e}")
         return pd.DataFrame()
\ No newline at end of file